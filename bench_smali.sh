@@ -0,0 +1,125 @@
+#!/bin/bash
+# Benchmark and parity check for the smali patch stages.
+# Runs the Bash edition's awk rewriters and the Python edition's patchers on the
+# same synthetic VMRunner/SignatureCheck smali files and compares output and time.
+#
+# Usage: ./bench_smali.sh [filler_methods]   (default: 20000)
+
+set -e
+
+SCRIPT_DIR=$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)
+METHODS="${1:-20000}"
+WORK_DIR=$(mktemp -d)
+trap 'rm -rf "$WORK_DIR"' EXIT
+
+# shellcheck source=patch.sh
+source "$SCRIPT_DIR/patch.sh" 2>/dev/null
+
+# Write a smali class with the protection methods buried among filler methods
+generate_smali() {
+  local class="$1"
+  local out="$2"
+  awk -v class="$class" -v methods="$METHODS" '
+  function filler(i) {
+    print ".method private filler" i "(I)I"
+    print "    .registers 3"
+    print "    add-int/lit8 v0, p1, 0x" i % 100
+    print "    mul-int/lit8 v0, v0, 0x3"
+    print "    return v0"
+    print ".end method"
+    print ""
+  }
+  BEGIN {
+    print ".class public L" class ";"
+    print ".super Ljava/lang/Object;"
+    print ""
+    half = int(methods / 2)
+    for (i = 0; i < half; i++) filler(i)
+    print ".method static constructor <clinit>()V"
+    print "    .registers 1"
+    print "    const-string v0, \"pairipcore\""
+    print "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V"
+    print "    invoke-static {}, Lcom/pairip/VMRunner;->init()V"
+    print "    return-void"
+    print ".end method"
+    print ""
+    print ".method public static verifyIntegrity(Landroid/content/Context;)V"
+    print "    .registers 4"
+    print "    .annotation system Ldalvik/annotation/Throws;"
+    print "        value = {"
+    print "            Ljava/lang/Exception;"
+    print "        }"
+    print "    .end annotation"
+    print "    invoke-static {p0}, Lcom/pairip/SignatureCheck;->check(Landroid/content/Context;)V"
+    print "    return-void"
+    print ".end method"
+    print ""
+    print ".method static verifySignatureMatches(Ljava/lang/String;)Z"
+    print "    .registers 3"
+    print "    const/4 v0, 0x0"
+    print "    return v0"
+    print ".end method"
+    print ""
+    print ".method public initializeLicenseCheck()V"
+    print "    .registers 2"
+    print "    invoke-direct {p0}, L" class ";->connectToLicensingService()V"
+    print "    return-void"
+    print ".end method"
+    print ""
+    print ".method private connectToLicensingService()V"
+    print "    .registers 2"
+    print "    return-void"
+    print ".end method"
+    print ""
+    for (i = half; i < methods; i++) filler(i)
+  }' > "$out"
+}
+
+elapsed_ms() {
+  local start=$1
+  local end=$2
+  echo $(( (end - start) / 1000000 ))
+}
+
+mkdir -p "$WORK_DIR/bash" "$WORK_DIR/python"
+generate_smali "com/pairip/VMRunner" "$WORK_DIR/bash/VMRunner.smali"
+generate_smali "com/pairip/SignatureCheck" "$WORK_DIR/bash/SignatureCheck.smali"
+cp "$WORK_DIR"/bash/*.smali "$WORK_DIR/python/"
+lines=$(cat "$WORK_DIR/bash/VMRunner.smali" "$WORK_DIR/bash/SignatureCheck.smali" | wc -l)
+
+log_header "Smali patch benchmark ($lines lines)"
+
+start=$(date +%s%N)
+patch_vmrunner "$WORK_DIR/bash/VMRunner.smali"
+patch_sigcheck "$WORK_DIR/bash/SignatureCheck.smali"
+end=$(date +%s%N)
+bash_ms=$(elapsed_ms "$start" "$end")
+
+python_cmd=$(command -v python3 || command -v python)
+# Time only the patch calls, not interpreter startup and imports
+python_ms=$("$python_cmd" - "$SCRIPT_DIR" "$WORK_DIR/python" <<'PY'
+import sys, os, time
+sys.path.insert(0, sys.argv[1])
+import patch
+work = sys.argv[2]
+start = time.perf_counter()
+patch.patch_vmrunner_smali(os.path.join(work, "VMRunner.smali"))
+patch.patch_license_smali(os.path.join(work, "SignatureCheck.smali"))
+print(int((time.perf_counter() - start) * 1000))
+PY
+)
+
+log_info "Bash (awk):  ${bash_ms} ms"
+log_info "Python:      ${python_ms} ms"
+
+status=0
+for file in VMRunner.smali SignatureCheck.smali; do
+  if cmp -s "$WORK_DIR/bash/$file" "$WORK_DIR/python/$file"; then
+    log_success "$file: output identical"
+  else
+    log_error "$file: outputs differ"
+    diff -u "$WORK_DIR/python/$file" "$WORK_DIR/bash/$file" | head -20
+    status=1
+  fi
+done
+exit $status
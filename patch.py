@@ -15,10 +15,30 @@ import platform
 from pathlib import Path
 import time
 import zipfile
+import hashlib
+import struct
+import json
 import urllib.request
 import threading
 import itertools
+import argparse
+import atexit
+import tempfile
+import sqlite3
+import contextvars
+import contextlib
+import weakref
+import traceback
 from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 # Auto-install required packages
 def install_dependencies():
@@ -72,40 +92,134 @@ except ImportError:
 # Initialize colorama
 init(autoreset=True)
 
+class PlainProgress:
+    """Progress counter for headless mode: logs a line per step instead of redrawing a bar"""
+    def __init__(self, logger, name, total, desc):
+        self.logger = logger
+        self.name = name
+        self.total = total
+        self.desc = desc
+        self.n = 0
+
+    def update(self, amount=1):
+        """Advance the counter and log the new position"""
+        self.n += amount
+        self.logger.emit("progress", f"{self.desc} {self.n:g}/{self.total:g}")
+
+    def close(self):
+        """Nothing to tear down without a terminal bar"""
+
+# Loggers still alive get their buffered lines flushed at exit
+live_loggers = weakref.WeakSet()
+
 class Logger:
-    """Beautiful logger for terminal output"""
-    def __init__(self):
+    """Beautiful logger for terminal output
+
+    When stdout is not a terminal (batch jobs, CI, log collectors) the logger
+    switches to headless mode: plain structured lines tagged with the job name,
+    written in buffered batches, with info lines rate-limited and no spinners.
+    """
+    # Headless buffering and rate limiting
+    FLUSH_INTERVAL = 1.0
+    FLUSH_LINES = 50
+    INFO_LINES_PER_SECOND = 20
+    # Written at once: a stage header may precede minutes without another line
+    URGENT_LEVELS = ("stage", "step", "warning", "error")
+
+    def __init__(self, headless=None):
         self.progress_bars = {}
+        self.headless = (not sys.stdout.isatty()) if headless is None else headless
+        self.job = "-"
+        self.buffer = []
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.window_start = self.last_flush
+        self.window_lines = 0
+        self.suppressed = 0
+        live_loggers.add(self)
+
+    def set_headless(self, headless):
+        """Force headless (True) or interactive (False) output"""
+        self.flush()
+        self.headless = headless
+
+    def emit(self, level, message):
+        """Queue one structured line; flushes on stage headers, warnings, errors, size or age"""
+        now = time.monotonic()
+        with self.lock:
+            if level == "info":
+                if now - self.window_start >= 1.0:
+                    self.window_start = now
+                    self.window_lines = 0
+                self.window_lines += 1
+                if self.window_lines > self.INFO_LINES_PER_SECOND:
+                    self.suppressed += 1
+                    return
+            timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self.buffer.append(f"ts={timestamp} job={self.job} level={level} msg={json.dumps(str(message), ensure_ascii=False)}\n")
+            urgent = level in self.URGENT_LEVELS
+        if urgent or len(self.buffer) >= self.FLUSH_LINES or now - self.last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Write buffered headless lines in one call"""
+        with self.lock:
+            if self.suppressed:
+                timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+                self.buffer.append(f"ts={timestamp} job={self.job} level=info msg=\"suppressed {self.suppressed} info lines\"\n")
+                self.suppressed = 0
+            if not self.buffer:
+                return
+            lines = "".join(self.buffer)
+            self.buffer = []
+            self.last_flush = time.monotonic()
+        sys.stdout.write(lines)
+        sys.stdout.flush()
     
     def info(self, message):
         """Print info message"""
+        if self.headless:
+            return self.emit("info", message)
         print(f"{Fore.BLUE}[i]{Style.RESET_ALL} {message}")
     
     def success(self, message):
         """Print success message"""
+        if self.headless:
+            return self.emit("success", message)
         print(f"{Fore.GREEN}[✓]{Style.RESET_ALL} {message}")
     
     def error(self, message):
         """Print error message"""
+        if self.headless:
+            return self.emit("error", message)
         print(f"{Fore.RED}[✗]{Style.RESET_ALL} {message}")
     
     def warning(self, message):
         """Print warning message"""
+        if self.headless:
+            return self.emit("warning", message)
         print(f"{Fore.YELLOW}[!]{Style.RESET_ALL} {message}")
     
     def header(self, message):
         """Print header message"""
+        if self.headless:
+            return self.emit("stage", message)
         print(f"\n{Style.BRIGHT}{Fore.CYAN}▶ {message}{Style.RESET_ALL}")
     
     def subheader(self, message):
         """Print subheader message"""
+        if self.headless:
+            return self.emit("step", message)
         print(f"{Fore.CYAN}  ➤ {message}{Style.RESET_ALL}")
     
     def create_progress_bar(self, name, total, desc="Processing"):
         """Create a new progress bar with enhanced visuals"""
+        if self.headless:
+            self.progress_bars[name] = PlainProgress(self, name, total, desc)
+            return self.progress_bars[name]
         self.progress_bars[name] = tqdm(total=total, 
                                         desc=f"{Fore.CYAN}{desc}{Style.RESET_ALL}",
-                                        bar_format="{desc}: {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}]",
+                                        bar_format="{desc}: {percentage:3.0f}%|{bar}| {n:g}/{total:g} [{elapsed}<{remaining}]",
                                         colour='cyan',
                                         dynamic_ncols=True)
         return self.progress_bars[name]
@@ -121,7 +235,65 @@ class Logger:
             self.progress_bars[name].close()
             del self.progress_bars[name]
 
-log = Logger()
+class LogRouter:
+    """Forwards logging to the logger of the job running in the current context
+
+    Job.run() installs its own logger for the duration of the run, so jobs on
+    different threads of one worker process never share a job tag or progress bars.
+    """
+    def __init__(self, default):
+        object.__setattr__(self, "default", default)
+
+    def __getattr__(self, name):
+        return getattr(active_logger.get() or self.default, name)
+
+    def __setattr__(self, name, value):
+        setattr(active_logger.get() or self.default, name, value)
+
+def flush_loggers():
+    """Flush the buffered lines of every live logger"""
+    for logger in list(live_loggers):
+        logger.flush()
+
+atexit.register(flush_loggers)
+
+active_logger = contextvars.ContextVar("active_logger", default=None)
+log = LogRouter(Logger())
+
+@contextlib.contextmanager
+def using_logger(logger):
+    """Route log calls in the current context to logger (no-op for None)"""
+    if logger is None:
+        yield
+        return
+    token = active_logger.set(logger)
+    try:
+        yield
+    finally:
+        active_logger.reset(token)
+
+class PatchError(Exception):
+    """Base class for pipeline failures; stage names the step that failed, if known"""
+    def __init__(self, message, stage=None):
+        super().__init__(message)
+        self.stage = stage
+
+class InputError(PatchError):
+    """The input bundle is missing, unreadable or has nothing to patch"""
+
+class ToolError(PatchError):
+    """A required jar or native library is missing"""
+
+class CommandError(ToolError):
+    """An external command exited with an error"""
+    def __init__(self, command, returncode, stderr="", stage=None):
+        super().__init__(f"Error executing command: {command}\n{stderr}".rstrip(), stage)
+        self.command = command
+        self.returncode = returncode
+        self.stderr = stderr
+
+class StageError(PatchError):
+    """A stage finished without producing its expected output"""
 
 def show_spinner(stop_event, message="LOADING"):
     """Show a colorful spinner animation with bird characters"""
@@ -139,62 +311,98 @@ def show_spinner(stop_event, message="LOADING"):
     sys.stdout.write(f'\r{" " * term_width}\r{Fore.GREEN}✔ Completed{Style.RESET_ALL}\n')
     sys.stdout.flush()
 
-def run_with_spinner(cmd, verbose=True, exit_on_error=True, spinner_message="Processing"):
-    """Run a command with a context-specific spinner"""
+def start_spinner(message):
+    """Start a spinner thread and return a function that stops it
+
+    In headless mode no thread is started; the message is logged once instead.
+    """
+    if log.headless:
+        # The command may run for minutes; show what it is now rather than after it
+        log.info(f"{message}...")
+        log.flush()
+        return lambda: None
     stop_event = threading.Event()
-    spinner_thread = threading.Thread(target=show_spinner, args=(stop_event, spinner_message))
+    spinner_thread = threading.Thread(target=show_spinner, args=(stop_event, message))
     spinner_thread.start()
-    
-    try:
-        result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-        stop_event.set()
-        spinner_thread.join()
-        
-        if result.returncode != 0 and exit_on_error:
-            if verbose:
-                log.error(f"Error executing command: {cmd}\n{result.stderr}")
-            sys.exit(1)
-        return result.stdout.strip()
-    except Exception as e:
+
+    def stop():
         stop_event.set()
         spinner_thread.join()
+    return stop
+
+def run_child(cmd, cwd=None, env=None):
+    """Run a shell command capturing its output; returns (returncode, stdout, stderr, peak RSS in KiB)
+
+    Where os.wait4 exists the child is reaped with it: its rusage covers that
+    child and everything it waited for (the JVM under the shell), not every
+    child this process ever had. The peak is None elsewhere.
+    """
+    if not hasattr(os, "wait4"):
+        result = subprocess.run(cmd, shell=True, capture_output=True, text=True, cwd=cwd, env=env)
+        return result.returncode, result.stdout, result.stderr, None
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                            cwd=cwd, env=env)
+    stderr = []
+    reader = threading.Thread(target=lambda: stderr.append(proc.stderr.read()))
+    reader.start()
+    stdout = proc.stdout.read()
+    reader.join()
+    proc.stdout.close()
+    proc.stderr.close()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    peak = usage.ru_maxrss // 1024 if platform.system() == "Darwin" else usage.ru_maxrss
+    return proc.returncode, stdout, "".join(stderr), peak
+
+def run_with_spinner(cmd, verbose=True, check=True, spinner_message="Processing", cwd=None, env=None, usage=None):
+    """Run a command with a context-specific spinner; raises CommandError on failure when check is set
+
+    With a usage dict, usage["peak_rss_kb"] is raised to the command's peak RSS.
+    """
+    stop_spinner = start_spinner(spinner_message)
+    
+    try:
+        returncode, stdout, stderr, peak = run_child(cmd, cwd=cwd, env=env)
+    except OSError as e:
+        stop_spinner()
         if verbose:
             log.error(f"Error executing command: {cmd}\n{str(e)}")
-        if exit_on_error:
-            sys.exit(1)
-        raise
+        raise CommandError(cmd, None, str(e)) from e
+    stop_spinner()
+    if usage is not None and peak:
+        usage["peak_rss_kb"] = max(usage.get("peak_rss_kb") or 0, peak)
+    
+    if returncode != 0 and check:
+        if verbose:
+            log.error(f"Error executing command: {cmd}\n{stderr}")
+        raise CommandError(cmd, returncode, stderr)
+    return stdout.strip()
 
-def run_command(command, verbose=False, exit_on_error=True):
+def run_command(command, verbose=False, check=True, cwd=None, env=None):
     """Run a shell command and return output with spinner"""
-    return run_with_spinner(command, verbose, exit_on_error, spinner_message="Processing")
+    return run_with_spinner(command, verbose, check, spinner_message="Processing", cwd=cwd, env=env)
 
-def extract_file(zipfile, target=None):
-    """Extract file from zip archive using platform-appropriate method"""
+def extract_file(archive, target=None, dest_dir="."):
+    """Extract file from zip archive into dest_dir using platform-appropriate method"""
     try:
-        if platform.system() == "Windows":
-            if shutil.which("7z"):
-                run_command(f'7z e "{zipfile}" {target or ""} -y -o.', verbose=False)
-            else:
-                with zipfile.ZipFile(zipfile, 'r') as zip_ref:
-                    if target:
-                        zip_ref.extract(target)
-                    else:
-                        zip_ref.extractall()
+        if platform.system() == "Windows" and shutil.which("7z"):
+            run_command(f'7z e "{archive}" {target or ""} -y -o"{dest_dir}"', verbose=False)
+        elif platform.system() != "Windows" and shutil.which("unzip"):
+            result = run_command(f'unzip -o "{archive}" {target or ""} -d "{dest_dir}"', verbose=False, check=False)
+            log.info(f"Unzip result: {result}")
+            if target and not os.path.exists(os.path.join(dest_dir, target)):
+                log.error(f"Extracted file not found after unzip")
+                return False
         else:
-            if shutil.which("unzip"):
-                result = run_command(f'unzip -o "{zipfile}" {target or ""}', verbose=False, exit_on_error=False)
-                log.info(f"Unzip result: {result}")
-                if not os.path.exists(target or ''):
-                    log.error(f"Extracted file not found after unzip")
-            else:
-                with zipfile.ZipFile(zipfile, 'r') as zip_ref:
-                    if target:
-                        zip_ref.extract(target)
-                    else:
-                        zip_ref.extractall()
+            with zipfile.ZipFile(archive, 'r') as zip_ref:
+                if target:
+                    zip_ref.extract(target, dest_dir)
+                else:
+                    zip_ref.extractall(dest_dir)
         return True
-    except Exception as e:
-        log.error(f"Failed to extract {target or 'files'} from {zipfile}: {e}")
+    except (OSError, zipfile.BadZipFile, KeyError, CommandError) as e:
+        log.error(f"Failed to extract {target or 'files'} from {archive}: {e}")
         return False
 
 def delete_dir_crossplatform(path):
@@ -214,6 +422,79 @@ def delete_dir_crossplatform(path):
         log.warning(f"Failed to delete {path}: {e}")
         return False
 
+GRAVEYARD_NAME = ".pairip-trash"
+pending_graveyards = set()
+pending_graveyards_lock = threading.Lock()
+
+def mark_graveyard(graveyard):
+    """Queue a trash directory for the next reaper"""
+    with pending_graveyards_lock:
+        pending_graveyards.add(graveyard)
+
+REAPER_SCRIPT = """
+import shutil, sys
+for graveyard in sys.argv[1:]:
+    shutil.rmtree(graveyard, ignore_errors=True)
+"""
+
+def move_to_graveyard(path):
+    """Atomically rename path into a trash directory on the same filesystem
+
+    The trash is emptied by a detached reaper process at exit (or by a later run),
+    so callers never wait on unlinking large trees.
+    """
+    abs_path = os.path.abspath(path)
+    graveyard = os.path.join(os.path.dirname(abs_path), GRAVEYARD_NAME)
+    target = os.path.join(graveyard, f"{os.path.basename(abs_path)}.{os.getpid()}.{time.time_ns()}")
+    for _ in range(2):
+        try:
+            os.makedirs(graveyard, exist_ok=True)
+            os.rename(abs_path, target)
+            mark_graveyard(graveyard)
+            return True
+        except FileNotFoundError:
+            # A reaper may have removed the graveyard between makedirs and rename
+            if not os.path.lexists(abs_path):
+                return False
+        except OSError:
+            break
+    return delete_dir_crossplatform(path)
+
+def discard_path(path):
+    """Remove a file or directory without blocking on the deletion"""
+    if not os.path.lexists(path):
+        return False
+    return move_to_graveyard(path)
+
+def discard_temp_leftovers(directory="."):
+    """Discard *.tmp* files and tmp-* directories the Java tools left in directory"""
+    count = 0
+    tmp_dirs = [d for d in glob.glob(os.path.join(directory, "tmp-*")) if os.path.isdir(d)]
+    for tmp_path in glob.glob(os.path.join(directory, "*.tmp*")) + tmp_dirs:
+        if discard_path(tmp_path):
+            count += 1
+    return count
+
+def reap_graveyards_async():
+    """Start a detached process that empties every graveyard used by this run"""
+    with pending_graveyards_lock:
+        graveyards = sorted(g for g in pending_graveyards if os.path.isdir(g))
+        pending_graveyards.clear()
+    if not graveyards:
+        return
+    kwargs = {"stdin": subprocess.DEVNULL, "stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL}
+    if platform.system() == "Windows":
+        kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+    try:
+        subprocess.Popen([sys.executable, "-c", REAPER_SCRIPT] + graveyards, **kwargs)
+    except OSError:
+        # Leave the trash for the next run to reap
+        pass
+
+atexit.register(reap_graveyards_async)
+
 def is_termux():
     """Check if running in a Termux environment"""
     return os.path.exists("/data/data/com.termux") or "TERMUX" in os.environ
@@ -228,12 +509,11 @@ def setup_termux_workdir():
     cleanup_count = 0
     for item in os.listdir(termux_dir):
         item_path = os.path.join(termux_dir, item)
+        if item == GRAVEYARD_NAME:
+            mark_graveyard(item_path)
+            continue
         try:
-            if os.path.isfile(item_path):
-                os.unlink(item_path)
-                cleanup_count += 1
-            elif os.path.isdir(item_path):
-                shutil.rmtree(item_path, ignore_errors=True)
+            if discard_path(item_path):
                 cleanup_count += 1
             log.info(f"Deleted during setup: {item}")
         except Exception as e:
@@ -243,40 +523,577 @@ def setup_termux_workdir():
         log.info(f"Cleaned {cleanup_count} items from Termux working directory")
     return termux_dir
 
-def copy_to_termux(src_path, dest_dir):
-    """Copy files to Termux working directory"""
+CACHE_DIR = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "pairip-remover")
+TOOL_CACHE_DIR = os.path.join(CACHE_DIR, "tools")
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in fixed-size chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def link_or_copy(src_path, dest_path):
+    """Hardlink src_path to dest_path, falling back to a symlink and then a copy"""
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    dest_dir = os.path.dirname(os.path.abspath(dest_path))
+    try:
+        if os.stat(src_path).st_dev == os.stat(dest_dir).st_dev:
+            os.link(src_path, dest_path)
+            return "hardlink"
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src_path), dest_path)
+        return "symlink"
+    except OSError:
+        pass
+    shutil.copy2(src_path, dest_path)
+    return "copy"
+
+def replace_file_text(path, content):
+    """Write content to path through a sibling temp file and a rename
+
+    The old inode is never modified, so a file that is a hardlink into a shared
+    tree (see create_shadow_tree) is detached instead of overwritten.
+    """
+    tmp_path = f"{path}.{os.getpid()}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        if isinstance(content, str):
+            f.write(content)
+        else:
+            f.writelines(content)
+    os.replace(tmp_path, path)
+
+def load_tool_cache_index():
+    """Load the tool cache index (name -> sha256 and source stamp)"""
+    index_path = os.path.join(TOOL_CACHE_DIR, "index.json")
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_tool_cache_index(index):
+    """Atomically write the tool cache index"""
+    index_path = os.path.join(TOOL_CACHE_DIR, "index.json")
+    tmp_path = index_path + ".part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+def cache_tool(src_path, index):
+    """Store a jar or native library in the persistent tool cache and return its cached path
+
+    The source is only re-hashed when its size or mtime changed since the last run,
+    and a refreshed cache entry is verified against the source hash before use.
+    """
+    os.makedirs(TOOL_CACHE_DIR, exist_ok=True)
+    name = os.path.basename(src_path)
+    cached_path = os.path.join(TOOL_CACHE_DIR, name)
+    st = os.stat(src_path)
+    stamp = [st.st_size, st.st_mtime_ns]
+    entry = index.get(name)
+
+    if entry and entry.get("stamp") == stamp and os.path.isfile(cached_path) \
+            and os.path.getsize(cached_path) == st.st_size:
+        return cached_path
+
+    digest = file_sha256(src_path)
+    if not (entry and entry.get("sha256") == digest and os.path.isfile(cached_path)
+            and file_sha256(cached_path) == digest):
+        tmp_path = cached_path + ".part"
+        shutil.copy2(src_path, tmp_path)
+        if file_sha256(tmp_path) != digest:
+            os.remove(tmp_path)
+            raise RuntimeError(f"Hash mismatch while caching {name}")
+        os.replace(tmp_path, cached_path)
+        log.info(f"Cached {name} ({digest[:12]})")
+
+    index[name] = {"sha256": digest, "stamp": stamp}
+    return cached_path
+
+def stage_to_termux(src_path, dest_dir):
+    """Stage a file in the Termux working directory by linking instead of copying"""
     try:
         if not os.path.exists(src_path):
             raise FileNotFoundError(f"Source file not found: {src_path}")
-            
+
         dest_path = os.path.join(dest_dir, os.path.basename(src_path))
-        if os.path.exists(dest_path):
-            os.remove(dest_path)
-        
         if os.path.isdir(src_path):
+            if os.path.exists(dest_path):
+                shutil.rmtree(dest_path, ignore_errors=True)
             shutil.copytree(src_path, dest_path)
-        else:
-            shutil.copy2(src_path, dest_path)
-        return dest_path
+            return dest_path, "copy"
+        return dest_path, link_or_copy(src_path, dest_path)
     except Exception as e:
-        raise RuntimeError(f"Error copying to Termux workdir: {str(e)}")
+        raise RuntimeError(f"Error staging to Termux workdir: {str(e)}")
 
-def move_result_back(termux_path, original_dir):
-    """Move the final result back to the original directory"""
+def stage_cached_tool(src_path, dest_dir, index):
+    """Link a tool from the persistent cache into the Termux working directory"""
     try:
-        if not os.path.exists(termux_path):
-            raise FileNotFoundError(f"Termux output not found: {termux_path}")
-            
-        final_name = os.path.basename(termux_path)
-        final_path = os.path.join(original_dir, final_name)
-        
-        if os.path.exists(final_path):
-            os.remove(final_path)
-            
-        shutil.move(termux_path, original_dir)
-        return final_path
+        cached_path = cache_tool(src_path, index)
     except Exception as e:
-        raise RuntimeError(f"Error moving result back: {str(e)}")
+        log.warning(f"Tool cache unavailable for {os.path.basename(src_path)}: {e}")
+        cached_path = src_path
+    return stage_to_termux(cached_path, dest_dir)
+
+SPLIT_STORE_DIR = os.path.join(CACHE_DIR, "splits")
+SPLIT_STORE_CAP_MB = 2048
+
+def load_split_store_index():
+    """Load the split store index: "crc:size" keys -> object hash, size and last use"""
+    try:
+        with open(os.path.join(SPLIT_STORE_DIR, "index.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_split_store_index(index):
+    """Atomically write the split store index"""
+    index_path = os.path.join(SPLIT_STORE_DIR, "index.json")
+    tmp_path = index_path + f".{os.getpid()}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+# Blobs whose SHA-256 was confirmed in this process, keyed by path and file stamp
+verified_split_blobs = set()
+
+def split_store_object_path(digest):
+    """Return the path of a stored blob"""
+    return os.path.join(SPLIT_STORE_DIR, "objects", digest[:2], digest)
+
+def store_zip_entry(zip_ref, info, index):
+    """Return the stored blob for a zip entry, extracting it into the store only on a miss
+
+    Entries are looked up by CRC and size first, so a hit costs no read of the bundle.
+    A hit's blob is then hashed once per process and must match its SHA-256 name;
+    a damaged blob is dropped and extracted again.
+    """
+    key = f"{info.CRC:08x}:{info.file_size}"
+    entry = index.get(key)
+    if entry:
+        object_path = split_store_object_path(entry["sha256"])
+        if os.path.isfile(object_path) and os.path.getsize(object_path) == info.file_size:
+            verified_key = (object_path, tuple(file_stamp(object_path)))
+            if verified_key in verified_split_blobs or file_sha256(object_path) == entry["sha256"]:
+                verified_split_blobs.add(verified_key)
+                entry["last_used"] = time.time()
+                return object_path, True
+            log.warning(f"Split store blob {entry['sha256'][:12]} is damaged, extracting it again")
+            os.remove(object_path)
+
+    objects_dir = os.path.join(SPLIT_STORE_DIR, "objects")
+    os.makedirs(objects_dir, exist_ok=True)
+    tmp_path = os.path.join(objects_dir, f".{os.getpid()}.{time.time_ns()}.part")
+    digest = hashlib.sha256()
+    try:
+        # zipfile verifies the CRC as the entry is streamed out
+        with zip_ref.open(info) as src, open(tmp_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(ZIP_COPY_CHUNK), b''):
+                digest.update(chunk)
+                dst.write(chunk)
+        object_path = split_store_object_path(digest.hexdigest())
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.replace(tmp_path, object_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    verified_split_blobs.add((object_path, tuple(file_stamp(object_path))))
+    index[key] = {"sha256": digest.hexdigest(), "size": info.file_size, "last_used": time.time()}
+    return object_path, False
+
+def evict_split_store(index, cap_bytes, keep=()):
+    """Delete least recently used blobs until the store fits in cap_bytes"""
+    total = sum(entry["size"] for entry in index.values())
+    evicted = 0
+    for key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+        if total <= cap_bytes:
+            break
+        object_path = split_store_object_path(entry["sha256"])
+        if object_path in keep:
+            continue
+        try:
+            os.remove(object_path)
+        except FileNotFoundError:
+            pass
+        total -= entry["size"]
+        del index[key]
+        evicted += 1
+    return evicted
+
+def stage_splits_from_store(apks_path, dest_dir, cap_mb=SPLIT_STORE_CAP_MB):
+    """Link every split APK of a bundle into dest_dir from the content-addressed store
+
+    Returns (splits staged, store hits, bytes extracted). Only splits whose CRC and
+    size are new to the store are read out of the bundle.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    index = load_split_store_index()
+    staged = hits = extracted = 0
+    used = set()
+    with zipfile.ZipFile(apks_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if not info.filename.endswith(".apk") or info.is_dir():
+                continue
+            object_path, hit = store_zip_entry(zip_ref, info, index)
+            used.add(object_path)
+            link_or_copy(object_path, os.path.join(dest_dir, os.path.basename(info.filename)))
+            staged += 1
+            if hit:
+                hits += 1
+            else:
+                extracted += info.file_size
+    evicted = evict_split_store(index, cap_mb * 1024 * 1024, keep=used)
+    if evicted:
+        log.info(f"Evicted {evicted} blob(s) from the split store")
+    save_split_store_index(index)
+    return staged, hits, extracted
+
+def publish_output(staged_path, final_path):
+    """Atomically put a finished APK at final_path, replacing any previous output
+
+    Across filesystems (Termux's work directory and shared storage) the file is
+    copied next to final_path first, so final_path never holds a partial APK.
+    """
+    try:
+        os.replace(staged_path, final_path)
+        return final_path
+    except OSError:
+        if not os.path.exists(staged_path):
+            raise
+    part_path = f"{final_path}.{os.getpid()}.part"
+    try:
+        shutil.copyfile(staged_path, part_path)
+        os.replace(part_path, final_path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(part_path)
+        raise
+    os.remove(staged_path)
+    return final_path
+
+DECOMPILE_DIR_NAME = "merged_app_decompile_xml"
+TMPFS_PATH = "/dev/shm"
+# Decompiled smali/XML is typically a few times larger than the packed APK
+DECOMPILE_EXPANSION = 4
+# Memory left for the rest of the system on top of the job's JVM heap
+TMPFS_SYSTEM_RESERVE = 512 * 1024 * 1024
+
+def get_available_memory():
+    """Return available physical memory in bytes, or None if unknown"""
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def get_free_space(path):
+    """Return free bytes on the filesystem holding path, or 0 if unknown"""
+    try:
+        return shutil.disk_usage(path).free
+    except OSError:
+        return 0
+
+def is_tmpfs(path):
+    """Check whether path lives on a memory-backed filesystem (tmpfs or ramfs)"""
+    try:
+        real_path = os.path.realpath(path)
+        best_mount, best_type = "", None
+        with open("/proc/mounts", 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                inside = real_path == mount_point or real_path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) >= len(best_mount):
+                    best_mount, best_type = mount_point, fields[2]
+        return best_type in ("tmpfs", "ramfs")
+    except OSError:
+        return False
+
+def tmpfs_fits(needed, path=TMPFS_PATH, java_heap=None):
+    """Check whether a job of the given scratch size fits in a tmpfs without starving the JVM
+
+    java_heap is the -Xmx the job's JVMs run with (JAVA_HEAP_MIN when unknown).
+    """
+    if not os.path.isdir(path) or not os.access(path, os.W_OK):
+        return False
+    available = get_available_memory()
+    headroom = (java_heap or JAVA_HEAP_MIN) + TMPFS_SYSTEM_RESERVE
+    if available is None or available < needed + headroom:
+        return False
+    return get_free_space(path) >= needed
+
+def benchmark_workspace(path, file_count=200, file_size=4096):
+    """Time a burst of small-file create/stat/unlink operations in path"""
+    bench_dir = tempfile.mkdtemp(prefix=".pairip-bench-", dir=path)
+    payload = b"\0" * file_size
+    start_time = time.perf_counter()
+    try:
+        for i in range(file_count):
+            sub_dir = os.path.join(bench_dir, str(i % 10))
+            os.makedirs(sub_dir, exist_ok=True)
+            with open(os.path.join(sub_dir, f"{i}.smali"), 'wb') as f:
+                f.write(payload)
+        for root, _, files in os.walk(bench_dir):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as f:
+                    f.read()
+    finally:
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    return time.perf_counter() - start_time
+
+def workspace_candidates(work_dir, needed, java_heap=None):
+    """List (label, path) scratch locations that can hold a job of the given size"""
+    candidates = []
+    if tmpfs_fits(needed, java_heap=java_heap):
+        candidates.append(("tmpfs", TMPFS_PATH))
+    temp_dir = tempfile.gettempdir()
+    # A tmpfs /tmp holds the tree in RAM, so it needs the same memory check as /dev/shm
+    temp_fits = tmpfs_fits(needed, temp_dir, java_heap) if is_tmpfs(temp_dir) else get_free_space(temp_dir) >= needed
+    if os.path.realpath(temp_dir) != os.path.realpath(TMPFS_PATH) and temp_fits:
+        candidates.append(("temp", temp_dir))
+    candidates.append(("disk", work_dir))
+    return candidates
+
+def select_workspace(work_dir, mode="auto", input_size=0, java_heap=None):
+    """Choose where the decompile tree lives; returns (label, scratch root)
+
+    Modes: "auto" uses tmpfs when memory allows and the working directory otherwise,
+    "bench" times every candidate and picks the fastest, "tmpfs"/"disk" force a
+    location, and any other value is used as an explicit directory.
+    """
+    needed = max(input_size, 1) * DECOMPILE_EXPANSION
+    if mode == "disk":
+        return "disk", work_dir
+    if mode == "tmpfs":
+        if tmpfs_fits(needed, java_heap=java_heap):
+            return "tmpfs", TMPFS_PATH
+        log.warning("Not enough memory for a tmpfs workspace, using the working directory")
+        return "disk", work_dir
+    if mode == "auto":
+        if tmpfs_fits(needed, java_heap=java_heap):
+            return "tmpfs", TMPFS_PATH
+        return "disk", work_dir
+    if mode == "bench":
+        timings = []
+        for label, path in workspace_candidates(work_dir, needed, java_heap):
+            try:
+                elapsed = benchmark_workspace(path)
+            except OSError as e:
+                log.warning(f"Skipping workspace {path}: {e}")
+                continue
+            log.info(f"Workspace {label} ({path}): {elapsed * 1000:.0f} ms")
+            timings.append((elapsed, label, path))
+        if timings:
+            _, label, path = min(timings)
+            return label, path
+        return "disk", work_dir
+    os.makedirs(mode, exist_ok=True)
+    return "custom", os.path.abspath(mode)
+
+def create_job_scratch(label, scratch_root):
+    """Return (job scratch dir, decompile dir) for this job inside the selected workspace
+
+    The scratch dir is None on disk, where the tree lives in the work directory;
+    otherwise it is a private directory the caller must discard.
+    """
+    if label == "disk":
+        return None, os.path.join(scratch_root, DECOMPILE_DIR_NAME)
+    job_dir = tempfile.mkdtemp(prefix="pairip-job-", dir=scratch_root)
+    return job_dir, os.path.join(job_dir, DECOMPILE_DIR_NAME)
+
+PRISTINE_DIR = os.path.join(CACHE_DIR, "pristine")
+# Views live next to the pristine trees so the shadow fallback can hardlink into them
+VIEWS_DIR = os.path.join(CACHE_DIR, "views")
+PRISTINE_CACHE_ENTRIES = 8
+
+def pristine_tree_key(input_hash, keep_abis, target_dex, apkeditor_hash):
+    """Key a decompiled tree by input bundle, ABI filter, decoded dex set and APKEditor build"""
+    material = "|".join([input_hash, ",".join(sorted(keep_abis or ())), ",".join(sorted(target_dex)) or "full",
+                         apkeditor_hash])
+    return hashlib.sha256(material.encode()).hexdigest()[:32]
+
+def pristine_lock_path(tree):
+    """Return the lock file that marks a pristine tree as in use"""
+    return os.path.join(os.path.dirname(tree), f".{os.path.basename(tree)}.inuse")
+
+def lock_pristine_tree(tree):
+    """Take a shared in-use lock on a pristine tree; returns the open lock file (None without fcntl)
+
+    The caller holds it for the life of every view of the tree and passes it to
+    release_pristine_tree(). Eviction removes the lock file with the tree, so a
+    lock on an unlinked file is retried on the current one.
+    """
+    if fcntl is None:
+        return None
+    os.makedirs(os.path.dirname(tree), exist_ok=True)
+    lock_path = pristine_lock_path(tree)
+    while True:
+        lock_file = open(lock_path, 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_SH)
+        try:
+            if os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path)):
+                return lock_file
+        except OSError:
+            pass
+        lock_file.close()
+
+def release_pristine_tree(lock_file):
+    """Drop an in-use lock taken by lock_pristine_tree()"""
+    if lock_file is not None:
+        lock_file.close()
+
+def evict_pristine_trees(keep):
+    """Drop least recently used pristine trees beyond PRISTINE_CACHE_ENTRIES
+
+    A tree is only removed while its in-use lock can be taken exclusively, so
+    trees that a running job still views are skipped.
+    """
+    try:
+        entries = [e for e in os.scandir(PRISTINE_DIR) if e.is_dir() and not e.name.startswith(".")]
+    except OSError:
+        return 0
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    evicted = 0
+    for entry in entries[PRISTINE_CACHE_ENTRIES:]:
+        if entry.path == keep:
+            continue
+        if fcntl is None:
+            if discard_path(entry.path):
+                evicted += 1
+            continue
+        lock_path = pristine_lock_path(entry.path)
+        try:
+            lock_file = open(lock_path, 'a')
+        except OSError:
+            continue
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+            if discard_path(entry.path):
+                evicted += 1
+                with contextlib.suppress(OSError):
+                    os.remove(lock_path)
+    return evicted
+
+def ensure_pristine_tree(key, decompile):
+    """Return (path, hit, lock) of the read-only decompiled tree for key
+
+    On a miss decompile(target_dir) fills a private build directory that is then
+    renamed into place, so concurrent jobs never see a half-written tree. lock is
+    the tree's in-use lock, already held; see lock_pristine_tree().
+    """
+    tree = os.path.join(PRISTINE_DIR, key)
+    lock = lock_pristine_tree(tree)
+    try:
+        if os.path.isdir(tree):
+            os.utime(tree)
+            return tree, True, lock
+        os.makedirs(PRISTINE_DIR, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix=".build-", dir=PRISTINE_DIR)
+        try:
+            decompile(os.path.join(build_dir, "tree"))
+            try:
+                os.rename(os.path.join(build_dir, "tree"), tree)
+            except OSError:
+                # Another job published the same tree first
+                if not os.path.isdir(tree):
+                    raise
+        finally:
+            discard_path(build_dir)
+    except BaseException:
+        release_pristine_tree(lock)
+        raise
+    evicted = evict_pristine_trees(keep=tree)
+    if evicted:
+        log.info(f"Evicted {evicted} pristine decompile tree(s)")
+    return tree, False, lock
+
+def mount_overlay(lower_dir, view_root):
+    """Mount a copy-on-write overlay of lower_dir; returns (merged dir, kind) or None"""
+    if platform.system() != "Linux":
+        return None
+    upper_dir, work_dir, merged_dir = (os.path.join(view_root, name) for name in ("upper", "work", "merged"))
+    for path in (upper_dir, work_dir, merged_dir):
+        os.makedirs(path, exist_ok=True)
+    options = f"lowerdir={lower_dir},upperdir={upper_dir},workdir={work_dir}"
+    attempts = [("overlayfs", ["mount", "-t", "overlay", "overlay", "-o", options, merged_dir])]
+    if shutil.which("fuse-overlayfs"):
+        attempts.append(("fuse-overlayfs", ["fuse-overlayfs", "-o", options, merged_dir]))
+    for kind, command in attempts:
+        try:
+            result = subprocess.run(command, capture_output=True, text=True)
+        except OSError:
+            continue
+        if result.returncode == 0:
+            return merged_dir, kind
+    return None
+
+def create_shadow_tree(lower_dir, target_dir):
+    """Mirror lower_dir into target_dir with hardlinks (symlinks across filesystems)
+
+    Patch stages write through replace_file_text/stage_file, which swap in a
+    new inode, so only the files they touch are materialized and the pristine
+    tree is never modified. Returns the number of files linked.
+    """
+    link = os.link
+    linked = 0
+    for root, dirs, files in os.walk(lower_dir):
+        dest_root = os.path.join(target_dir, os.path.relpath(root, lower_dir))
+        os.makedirs(dest_root, exist_ok=True)
+        for name in files:
+            src_path = os.path.join(root, name)
+            dest_path = os.path.join(dest_root, name)
+            try:
+                link(src_path, dest_path)
+            except OSError:
+                if link is os.symlink:
+                    raise
+                link = os.symlink
+                link(src_path, dest_path)
+            linked += 1
+    return linked
+
+def open_overlay_view(pristine_tree):
+    """Create a writable copy-on-write view of a pristine tree; returns (view dir, view root, kind)"""
+    os.makedirs(VIEWS_DIR, exist_ok=True)
+    view_root = tempfile.mkdtemp(prefix="view-", dir=VIEWS_DIR)
+    mounted = mount_overlay(pristine_tree, view_root)
+    if mounted:
+        return mounted[0], view_root, mounted[1]
+    discard_path(view_root)
+    view_root = tempfile.mkdtemp(prefix="view-", dir=VIEWS_DIR)
+    view_dir = os.path.join(view_root, DECOMPILE_DIR_NAME)
+    linked = create_shadow_tree(pristine_tree, view_dir)
+    log.info(f"Shadow view: linked {linked} files")
+    return view_dir, view_root, "shadow"
+
+def close_overlay_view(view_root, kind):
+    """Unmount (if mounted) and discard an overlay view"""
+    merged_dir = os.path.join(view_root, "merged")
+    if kind == "overlayfs":
+        subprocess.run(["umount", merged_dir], capture_output=True)
+    elif kind == "fuse-overlayfs":
+        unmount = shutil.which("fusermount3") or shutil.which("fusermount") or "fusermount"
+        subprocess.run([unmount, "-u", merged_dir], capture_output=True)
+    if os.path.ismount(merged_dir):
+        log.warning(f"Could not unmount overlay view: {merged_dir}")
+        return False
+    return discard_path(view_root)
 
 def process_xml_file(xml_path):
     """Process an XML file (validate or transform)"""
@@ -290,519 +1107,1858 @@ def process_xml_file(xml_path):
         log.warning(f"Error processing {xml_path}: {e}")
         return False
 
-def patch_files():
-    """Apply patches to the decompiled files"""
-    base_dir = os.path.expanduser('merged_app_decompile_xml')
-    smali_base_dir = os.path.join(base_dir, 'smali')
-    base_lib_dir = os.path.join(base_dir, 'root/lib')
-    resources_dir = os.path.join(base_dir, 'resources')
-    cwd = os.getcwdb().decode('utf-8')
-    
-    log.header("Applying patches to decompiled files")
+PAIRIP_TYPE_PREFIX = b"Lcom/pairip/"
+DEX_NAME_PATTERN = re.compile(r'^classes\d*\.dex$')
+ZIP_COPY_CHUNK = 1024 * 1024
+# Entries parsed in memory (dex files, manifests) are bounded by their formats in
+# practice; anything larger is refused rather than read whole. Everything else streams.
+MAX_INMEMORY_ENTRY = 64 * 1024 * 1024
 
-    # Verify architectures in the APK
-    log.subheader("Verifying native library architectures...")
-    architectures = []
-    try:
-        with zipfile.ZipFile("merged_app.apk", 'r') as zip_ref:
-            for file in zip_ref.namelist():
-                if file.startswith("lib/") and file.endswith("libpairipcore.so"):
-                    arch = file.split("/")[1]
-                    architectures.append(arch)
-        if architectures:
-            log.success(f"Found architectures: {', '.join(architectures)}")
-        else:
-            log.warning("No native libraries found in APK")
-    except Exception as e:
-        log.warning(f"Could not verify architectures: {e}")
+def read_entry_bounded(zip_ref, info, limit=MAX_INMEMORY_ENTRY):
+    """Read a small zip entry into memory, refusing entries larger than limit"""
+    if info.file_size > limit:
+        raise ValueError(f"{info.filename} is {info.file_size} bytes, more than the {limit} byte in-memory limit")
+    return zip_ref.read(info)
 
-    # Smali patching definitions
-    new_clinit_block = [
-        ".method static constructor <clinit>()V",
-        "    .registers 1",
-        "",
-        "    .line 30",
-        "    const-string v0, \"pairipcorex\"",
-        "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V",
-        "",
-        "    const-string v0, \"pairipcore\"",
-        "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V",
-        "",
-        "    return-void",
-        ".end method"
-    ]
+def read_uleb128(data, offset):
+    """Decode an unsigned LEB128 value; returns (value, next offset)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
 
-    new_verify_signature_block = [
-        ".method static verifySignatureMatches(Ljava/lang/String;)Z",
-        "    .registers 1",
-        "",
-        "    const/4 p0, 0x1",
-        "    return p0",
-        ".end method"
-    ]
+def dex_type_descriptors(data, prefix=b""):
+    """Yield type descriptors from a dex file's type_ids table that start with prefix"""
+    if data[:4] != b"dex\n":
+        raise ValueError("Not a dex file")
+    _, string_ids_off, type_ids_size, type_ids_off = struct.unpack_from('<4I', data, 0x38)
+    for i in range(type_ids_size):
+        (string_idx,) = struct.unpack_from('<I', data, type_ids_off + i * 4)
+        (string_data_off,) = struct.unpack_from('<I', data, string_ids_off + string_idx * 4)
+        _, start = read_uleb128(data, string_data_off)
+        if data.startswith(prefix, start):
+            end = data.index(b"\0", start)
+            yield data[start:end].decode('utf-8', errors='replace')
 
-    new_initialize_license_block = [
-        ".method public initializeLicenseCheck()V",
-        "    .registers 1",
-        "    return-void",
-        ".end method"
-    ]
+def find_pairip_dex(apk_path):
+    """Map each classesN.dex in an APK to the com/pairip types it defines or references"""
+    targets = {}
+    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if not DEX_NAME_PATTERN.match(info.filename):
+                continue
+            types = list(dex_type_descriptors(read_entry_bounded(zip_ref, info), PAIRIP_TYPE_PREFIX))
+            if types:
+                targets[info.filename] = types
+    return targets
 
-    new_connect_license_block = [
-        ".method private connectToLicensingService()V",
-        "    .registers 1",
-        "    return-void",
-        ".end method"
-    ]
+PROTECTION_CLASSES = ("VMRunner", "SignatureCheck", "LicenseClient")
+LICENSE_MANIFEST_MARKERS = (
+    "com.pairip.licensecheck.LicenseActivity",
+    "com.pairip.licensecheck.LicenseContentProvider",
+    "com.android.vending.CHECK_LICENSE",
+)
 
-    # Apply Smali patches
-    log.subheader("Patching protection code...")
-    stop_event = threading.Event()
-    spinner_thread = threading.Thread(target=show_spinner, args=(stop_event, "Patching Smali"))
-    spinner_thread.start()
+# string_data_item for "pairipcorex": uleb128 length, MUTF-8 bytes, NUL. Only the
+# patched VMRunner.<clinit> loads this library, so its presence marks patched dex code.
+PATCHED_CLINIT_MARKER = b"\x0bpairipcorex\x00"
 
-    vmrunner_patched = False
-    sigcheck_patched = False
-    verify_signature_patched = False
-    initialize_license_patched = False
-    connect_license_patched = False
-    
-    smali_dirs = [d for d in os.listdir(smali_base_dir) if d.startswith('classes') and os.path.isdir(os.path.join(smali_base_dir, d))]
-    
-    if not smali_dirs:
-        stop_event.set()
-        spinner_thread.join()
-        log.warning("No smali/classes* directories found, skipping Smali patching")
-    else:
-        for smali_dir in smali_dirs:
-            pairip_dir = os.path.join(smali_base_dir, smali_dir, 'com/pairip')
-            if not os.path.exists(pairip_dir):
-                continue
+def zip_entry_data_offset(zip_ref, info):
+    """Return the archive offset of an entry's data, past its local header"""
+    zip_ref.fp.seek(info.header_offset)
+    header = zip_ref.fp.read(zipfile.sizeFileHeader)
+    if header[:4] != zipfile.stringFileHeader:
+        raise ValueError(f"bad local header for {info.filename}")
+    name_length, extra_length = struct.unpack('<HH', header[26:30])
+    return info.header_offset + zipfile.sizeFileHeader + name_length + extra_length
 
-            for root, dirs, files in os.walk(pairip_dir):
-                if 'VMRunner.smali' in files:
-                    vmrunner_path = os.path.join(root, 'VMRunner.smali')
-                    try:
-                        with open(vmrunner_path, 'r', encoding='utf-8') as f:
-                            lines = f.readlines()
-
-                        new_lines = []
-                        inside_clinit = False
-                        method_start_found = False
-
-                        for line in lines:
-                            if not inside_clinit and line.strip().startswith('.method') and '<clinit>()V' in line:
-                                inside_clinit = True
-                                method_start_found = True
-                                new_lines.extend(line + '\n' for line in new_clinit_block)
-                                continue
-
-                            if inside_clinit:
-                                if line.strip() == '.end method':
-                                    inside_clinit = False
-                                continue
-
-                            new_lines.append(line)
-
-                        if method_start_found:
-                            with open(vmrunner_path, 'w', encoding='utf-8') as f:
-                                f.writelines(new_lines)
-                            vmrunner_patched = True
-                    except Exception as e:
-                        log.error(f"Failed to patch VMRunner.smali: {e}")
+class EntrySlice:
+    """Seekable read-only view of a stored zip entry inside its archive
 
-                if 'SignatureCheck.smali' in files or 'LicenseClient.smali' in files:
-                    smali_file = 'LicenseClient.smali' if 'LicenseClient.smali' in files else 'SignatureCheck.smali'
-                    sig_path = os.path.join(root, smali_file)
-                    try:
-                        with open(sig_path, 'r', encoding='utf-8') as f:
-                            lines = f.readlines()
-
-                        new_lines = []
-                        inside_verify = False
-                        inside_verify_signature = False
-                        inside_initialize_license = False
-                        inside_connect_license = False
-                        verify_method_found = False
-                        verify_signature_method_found = False
-                        initialize_license_method_found = False
-                        connect_license_method_found = False
-
-                        i = 0
-                        while i < len(lines):
-                            stripped = lines[i].strip()
-
-                            if not inside_verify and stripped.startswith('.method') and 'verifyIntegrity(Landroid/content/Context;)V' in stripped:
-                                inside_verify = True
-                                verify_method_found = True
-                                new_lines.append(lines[i])
-                                i += 1
-                                new_lines.append('    .registers 1\n')
-                                new_lines.append('    return-void\n')
-                                new_lines.append('.end method\n')
-                                while i < len(lines) and not lines[i].strip().startswith('.end method'):
-                                    i += 1
-                                i += 1
-                                continue
-
-                            if not inside_verify_signature and stripped.startswith('.method') and 'verifySignatureMatches(Ljava/lang/String;)Z' in stripped:
-                                inside_verify_signature = True
-                                verify_signature_method_found = True
-                                new_lines.extend(line + '\n' for line in new_verify_signature_block)
-                                while i < len(lines) and not lines[i].strip().startswith('.end method'):
-                                    i += 1
-                                i += 1
-                                continue
-
-                            if not inside_initialize_license and stripped.startswith('.method') and 'initializeLicenseCheck()V' in stripped:
-                                inside_initialize_license = True
-                                initialize_license_method_found = True
-                                new_lines.extend(line + '\n' for line in new_initialize_license_block)
-                                while i < len(lines) and not lines[i].strip().startswith('.end method'):
-                                    i += 1
-                                i += 1
-                                continue
-
-                            if not inside_connect_license and stripped.startswith('.method') and 'connectToLicensingService()V' in stripped:
-                                inside_connect_license = True
-                                connect_license_method_found = True
-                                new_lines.extend(line + '\n' for line in new_connect_license_block)
-                                while i < len(lines) and not lines[i].strip().startswith('.end method'):
-                                    i += 1
-                                i += 1
-                                continue
-
-                            new_lines.append(lines[i])
-                            i += 1
-
-                        if verify_method_found or verify_signature_method_found or initialize_license_method_found or connect_license_method_found:
-                            with open(sig_path, 'w', encoding='utf-8') as f:
-                                f.writelines(new_lines)
-                            if verify_method_found:
-                                sigcheck_patched = True
-                            if verify_signature_method_found:
-                                verify_signature_patched = True
-                            if initialize_license_method_found:
-                                initialize_license_patched = True
-                            if connect_license_method_found:
-                                connect_license_patched = True
-                    except Exception as e:
-                        log.error(f"Failed to patch {smali_file}: {e}")
+    Opening a nested APK through ZipFile.open() makes every seek read forward
+    through the entry; this view seeks directly, so reading a split's central
+    directory costs the same for a 5 MB and a 5 GB split.
+    """
+    def __init__(self, path, start, size):
+        self.file = open(path, 'rb')
+        self.start = start
+        self.size = size
+        self.pos = 0
 
-        stop_event.set()
-        spinner_thread.join()
+    def seekable(self):
+        return True
 
-        if vmrunner_patched:
-            log.success("Patched VMRunner.smali")
-        if sigcheck_patched:
-            log.success("Patched verifyIntegrity")
-        if verify_signature_patched:
-            log.success("Patched verifySignatureMatches")
-        if initialize_license_patched:
-            log.success("Patched initializeLicenseCheck")
-        if connect_license_patched:
-            log.success("Patched connectToLicensingService")
-        if not (vmrunner_patched or sigcheck_patched or verify_signature_patched or initialize_license_patched or connect_license_patched):
-            log.warning("No Smali files patched")
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.pos, os.SEEK_END: self.size}[whence]
+        self.pos = max(0, min(self.size, base + offset))
+        return self.pos
 
-# Copy .so Files
-    log.subheader("Copying native libraries...")
-    so_files_to_copy = [
-        'libpairipcorex.so',
-        'libFirebaseCppApp.so'
-    ]
+    def tell(self):
+        return self.pos
 
-    # Use the current working directory (~/apk_work in Termux)
-    current_dir = os.getcwd()
-    log.info(f"Checking for .so files in working directory: {current_dir}")
-    
-    missing = [f for f in so_files_to_copy if not os.path.exists(os.path.join(current_dir, f))]
-    if missing:
-        log.error(f"Missing .so files in working directory ({current_dir}): {', '.join(missing)}")
-        sys.exit(1)
-    
-    supported_archs = ['armeabi-v7a', 'arm64-v8a', 'x86', 'x86_64']
-    lib_dirs_found = 0
-    arch_types = []
-    for root, dirs, files in os.walk(base_lib_dir):
-        if 'libpairipcore.so' in files:
-            arch_type = os.path.basename(root)
-            if arch_type in architectures and arch_type in supported_archs:
-                arch_types.append(arch_type)
-                lib_dirs_found += 1
-                for so_file in so_files_to_copy:
-                    src_path = os.path.join(current_dir, so_file)
-                    dst_path = os.path.join(root, so_file)
-                    try:
-                        shutil.copy2(src_path, dst_path)
-                        log.success(f'Copied {so_file} to {arch_type} architecture')
-                    except Exception as e:
-                        log.error(f"Failed to copy {so_file} to {arch_type}: {e}")
-                        sys.exit(1)
-            else:
-                log.warning(f"Skipping incompatible architecture: {arch_type}")
-    
-    if lib_dirs_found == 0:
-        log.warning("No library directories found containing libpairipcore.so")
-    else:
-        log.success(f"Libraries copied to {lib_dirs_found} architecture(s): {', '.join(arch_types)}")
-        
-    # Patch file_paths.xml
-    log.subheader("Patching file paths configuration...")
-    file_paths_patched = False
-    pattern = re.compile(
-        r'<external-path\s+name="[^"]*"\s+path="Android/data/[^"]*/files/Pictures"\s*/>',
-        re.IGNORECASE
-    )
-    replacement = '<external-files-path name="my_images" path="Pictures/" />'
-
-    for root, dirs, files in os.walk(resources_dir):
-        if 'file_paths.xml' in files and 'res/xml' in root:
-            xml_path = os.path.join(root, 'file_paths.xml')
-            try:
-                with open(xml_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-
-                if pattern.search(content):
-                    content_new = pattern.sub(replacement, content)
-                    with open(xml_path, 'w', encoding='utf-8') as f:
-                        f.write(content_new)
-                    file_paths_patched = True
-                    log.success("Patched file_paths.xml")
-            except Exception as e:
-                log.error(f"Failed to patch {xml_path}: {e}")
-
-    if not file_paths_patched:
-        log.warning("No matching <external-path> entries found")
+    def read(self, n=-1):
+        remaining = self.size - self.pos
+        n = remaining if n is None or n < 0 else min(n, remaining)
+        self.file.seek(self.start + self.pos)
+        data = self.file.read(n)
+        self.pos += len(data)
+        return data
 
-    return vmrunner_patched or sigcheck_patched or verify_signature_patched or initialize_license_patched or connect_license_patched or file_paths_patched
+    def close(self):
+        self.file.close()
 
-def process_apk(apks_file, so_path=None):
-    """Process an APKS file with Termux optimization"""
-    original_dir = os.path.dirname(os.path.abspath(apks_file))
-    work_dir = original_dir
-    termux_files = {}
+    def __enter__(self):
+        return self
 
-    required_jars = ["APKEditor-1.4.3.jar", "uber-apk-signer.jar"]
-    for jar in required_jars:
-        if not os.path.exists(os.path.join(original_dir, jar)):
-            log.error(f"Required JAR file '{jar}' not found")
-            sys.exit(1)
+    def __exit__(self, *exc):
+        self.close()
 
-    if is_termux():
-        log.header("Preparing Termux environment...")
-        work_dir = setup_termux_workdir()
-        stop_event = threading.Event()
-        spinner_thread = threading.Thread(target=show_spinner, args=(stop_event, "Setting up Termux"))
-        spinner_thread.start()
+def open_nested_entry(path, zip_ref, info):
+    """Open a nested archive entry for ZipFile: a direct slice when stored, a stream otherwise"""
+    if info.compress_type == zipfile.ZIP_STORED:
+        return EntrySlice(path, zip_entry_data_offset(zip_ref, info), info.file_size)
+    return zip_ref.open(info)
 
-        try:
-            termux_files = {
-                "apks": copy_to_termux(apks_file, work_dir),
-                "apkeditor": copy_to_termux(os.path.join(original_dir, "APKEditor-1.4.3.jar"), work_dir),
-                "signer": copy_to_termux(os.path.join(original_dir, "uber-apk-signer.jar"), work_dir)
-            }
+def scan_apk_zip(zip_ref, split_name, report):
+    """Record protection classes, native libraries and license entries found in one APK"""
+    for info in zip_ref.infolist():
+        name = info.filename
+        if DEX_NAME_PATTERN.match(name):
+            dex_data = read_entry_bounded(zip_ref, info)
+            found = False
+            for descriptor in dex_type_descriptors(dex_data, PAIRIP_TYPE_PREFIX):
+                simple_name = descriptor.rstrip(';').rsplit('/', 1)[-1]
+                if simple_name in PROTECTION_CLASSES:
+                    report["classes"].setdefault(simple_name, []).append(f"{split_name}!{name}")
+                    found = True
+            if found and PATCHED_CLINIT_MARKER in dex_data:
+                report["patched"]["clinit"].append(f"{split_name}!{name}")
+        elif name.startswith("lib/") and name.endswith("/libpairipcore.so"):
+            report["abis"].setdefault(name.split("/")[1], split_name)
+        elif name.startswith("lib/") and name.endswith("/libpairipcorex.so"):
+            report["patched"]["libpairipcorex"].append(name.split("/")[1])
+        elif name == "AndroidManifest.xml":
+            # Binary XML string pools are UTF-8 or UTF-16LE; matching both avoids decoding the pool
+            manifest = read_entry_bounded(zip_ref, info)
+            for marker in LICENSE_MANIFEST_MARKERS:
+                if marker.encode('utf-8') in manifest or marker.encode('utf-16-le') in manifest:
+                    report["manifest"].setdefault(marker, split_name)
 
-            script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-            # Only check for libpairipcorex.so, as libFirebaseCppApp.so is generated later
-            required_libs = ["libpairipcorex.so"]
-            for lib in required_libs:
-                lib_path = None
-                if so_path and os.path.exists(os.path.join(so_path, lib)):
-                    lib_path = os.path.join(so_path, lib)
-                elif os.path.exists(os.path.join(original_dir, lib)):
-                    lib_path = os.path.join(original_dir, lib)
-                elif os.path.exists(os.path.join(script_dir, lib)):
-                    lib_path = os.path.join(script_dir, lib)
-
-                if lib_path:
-                    copy_to_termux(lib_path, work_dir)
-                    log.success(f"Copied {lib} to Termux working directory")
-                else:
-                    log.error(f"Library not found: {lib}")
-                    stop_event.set()
-                    spinner_thread.join()
-                    sys.exit(1)
-        except Exception as e:
-            stop_event.set()
-            spinner_thread.join()
-            log.error(f"Error preparing Termux environment: {e}")
-            sys.exit(1)
-        stop_event.set()
-        spinner_thread.join()
+# Split bundle containers (bundletool/SAI, APKPure, APKMirror)
+BUNDLE_EXTENSIONS = (".apks", ".xapk", ".apkm")
+# Root entries that only a bundle carries; a plain APK has AndroidManifest.xml instead
+BUNDLE_MARKERS = ("base.apk", "toc.pb", "manifest.json", "info.json")
 
-    os.chdir(work_dir)
-    
-    base_name = os.path.basename(apks_file).rsplit('.', 1)[0]
-    decompile_dir = os.path.expanduser("merged_app_decompile_xml")
-    
-    if "_JAVA_OPTIONS" not in os.environ:
-        os.environ["_JAVA_OPTIONS"] = os.environ.get("_JAVA_OPTIONS", "") + " -Xmx2g"
-    
-    total_steps = 11
-    progress = log.create_progress_bar("main", total_steps, "Patching process")
-    
-    # Step 1: Extract base.apk
-    start_time = time.time()
-    log.header("Step 1/11: Extracting base.apk")
-    success = extract_file(termux_files.get("apks", apks_file), "base.apk")
-    if not success:
-        log.error("Failed to extract base.apk")
-        sys.exit(1)
-    log.success(f"Extracted base.apk in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+def is_split_bundle(path, zip_ref):
+    """Decide whether an archive is a split bundle or a plain APK by its container type
+
+    A plain APK may embed .apk assets (plugins, asset packs), so the mere presence
+    of nested APKs does not make it a bundle.
+    """
+    if path.lower().endswith(BUNDLE_EXTENSIONS):
+        return True
+    names = set(zip_ref.namelist())
+    return "AndroidManifest.xml" not in names and any(marker in names for marker in BUNDLE_MARKERS)
+
+def scan_input(path):
+    """Report the PairIP protection layout of an .apks or .apk file without extracting it"""
+    start_time = time.perf_counter()
+    report = {"input": path, "classes": {}, "abis": {}, "manifest": {}, "splits": 0, "error": None,
+              "patched": {"clinit": [], "libpairipcorex": []}}
+    try:
+        with zipfile.ZipFile(path, 'r') as zip_ref:
+            if is_split_bundle(path, zip_ref):
+                splits = [info for info in zip_ref.infolist() if info.filename.endswith(".apk")]
+                for info in splits:
+                    with open_nested_entry(path, zip_ref, info) as split_file, zipfile.ZipFile(split_file) as split_zip:
+                        scan_apk_zip(split_zip, info.filename, report)
+                report["splits"] = len(splits)
+            else:
+                scan_apk_zip(zip_ref, os.path.basename(path), report)
+    except (OSError, zipfile.BadZipFile, ValueError, struct.error) as e:
+        report["error"] = str(e)
+    report["protected"] = bool(report["classes"] or report["abis"])
+    report["already_patched"] = is_already_patched(report)
+    report["seconds"] = round(time.perf_counter() - start_time, 3)
+    return report
+
+def is_already_patched(report):
+    """Decide from a scan report whether an input is the output of a previous run"""
+    patched = report["patched"]
+    if patched["clinit"]:
+        return True
+    return bool(patched["libpairipcorex"]) and not report["manifest"]
+
+def print_scan_report(report):
+    """Print one scan report in the usual log format"""
+    name = os.path.basename(report["input"])
+    if report["error"]:
+        log.error(f"{name}: {report['error']}")
+        return
+    if report["already_patched"]:
+        log.warning(f"{name}: already patched ({report['seconds']:.2f}s)")
+        return
+    if not report["protected"]:
+        log.warning(f"{name}: no PairIP protection found ({report['seconds']:.2f}s)")
+        return
+    log.success(f"{name}: PairIP protection found ({report['seconds']:.2f}s)")
+    for class_name, locations in sorted(report["classes"].items()):
+        log.info(f"  {class_name}: {', '.join(locations)}")
+    if report["abis"]:
+        log.info(f"  libpairipcore.so: {', '.join(f'{abi} ({split})' for abi, split in sorted(report['abis'].items()))}")
+    if report["manifest"]:
+        log.info(f"  Manifest: {', '.join(marker.rsplit('.', 1)[-1] for marker in report['manifest'])}")
+
+def scan_main(argv):
+    """Entry point for the scan command"""
+    parser = argparse.ArgumentParser(prog="patch.py scan",
+                                     description="Report PairIP protection layout without running the pipeline")
+    parser.add_argument("inputs", nargs="+", help=".apks or .apk files to scan")
+    parser.add_argument("--json", action="store_true", help="print one JSON report per line")
+    parser.add_argument("--jobs", type=int, default=None, help="number of parallel workers (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    if len(args.inputs) == 1:
+        reports = [scan_input(args.inputs[0])]
+    else:
+        with Pool(args.jobs) as pool:
+            reports = pool.map(scan_input, args.inputs)
+
+    for report in reports:
+        if args.json:
+            print(json.dumps(report, sort_keys=True))
+        else:
+            print_scan_report(report)
+    return 1 if any(report["error"] for report in reports) else 0
+
+def copy_zip_entry_raw(src_path, info, dst_zip):
+    """Append an entry's compressed bytes from src_path to dst_zip without recompressing"""
+    clone = zipfile.ZipInfo(info.filename, info.date_time)
+    clone.compress_type = info.compress_type
+    clone.CRC = info.CRC
+    clone.compress_size = info.compress_size
+    clone.file_size = info.file_size
+    clone.external_attr = info.external_attr
+    clone.create_system = info.create_system
+    zip64 = info.file_size > zipfile.ZIP64_LIMIT or info.compress_size > zipfile.ZIP64_LIMIT
+
+    with open(src_path, 'rb') as src:
+        src.seek(info.header_offset)
+        header = src.read(30)
+        name_len, extra_len = struct.unpack('<HH', header[26:30])
+        src.seek(name_len + extra_len, os.SEEK_CUR)
+
+        dst = dst_zip.fp
+        clone.header_offset = dst.tell()
+        dst.write(clone.FileHeader(zip64))
+        remaining = info.compress_size
+        while remaining:
+            chunk = src.read(min(ZIP_COPY_CHUNK, remaining))
+            if not chunk:
+                raise zipfile.BadZipFile(f"Truncated entry: {info.filename}")
+            dst.write(chunk)
+            remaining -= len(chunk)
+
+    dst_zip.filelist.append(clone)
+    dst_zip.NameToInfo[clone.filename] = clone
+    dst_zip.start_dir = dst.tell()
+    dst_zip._didModify = True
+
+def is_signature_entry(name):
+    """Check whether a zip entry belongs to the v1 signature (rewritten by the signer)"""
+    return name.startswith("META-INF/") and name.rsplit('.', 1)[-1].upper() in ("MF", "SF", "RSA", "DSA", "EC")
+
+def create_slim_apk(src_apk, dst_apk, keep_dex):
+    """Write a copy of src_apk holding only the dex files and libraries the patches touch
+
+    Untouched dex files, assets and native libraries are left out so APKEditor
+    decodes and re-encodes only what is patched; they are spliced back afterwards.
+    """
+    dropped = 0
+    with zipfile.ZipFile(src_apk, 'r') as zip_in, zipfile.ZipFile(dst_apk, 'w') as zip_out:
+        for info in zip_in.infolist():
+            name = info.filename
+            if is_signature_entry(name):
+                continue
+            if DEX_NAME_PATTERN.match(name) and name not in keep_dex:
+                dropped += 1
+                continue
+            if name.startswith("assets/") or (name.startswith("lib/") and not name.endswith("/libpairipcore.so")):
+                dropped += 1
+                continue
+            copy_zip_entry_raw(src_apk, info, zip_out)
+    return dropped
+
+def splice_minimal_build(original_apk, rebuilt_apk, out_apk):
+    """Combine a rebuilt slim APK with the untouched entries of the original APK
+
+    Rebuilt entries win. When the patched resource files keep their original
+    paths, resources.arsc and every other res/ entry are reused byte-for-byte.
+    """
+    with zipfile.ZipFile(original_apk, 'r') as zip_orig, zipfile.ZipFile(rebuilt_apk, 'r') as zip_new:
+        orig_names = set(zip_orig.namelist())
+        new_infos = {info.filename: info for info in zip_new.infolist() if not is_signature_entry(info.filename)}
+        patched_res = [name for name in new_infos if name.startswith("res/") and name.endswith("/file_paths.xml")]
+        reuse_resources = all(name in orig_names for name in patched_res)
+
+        def take_rebuilt(name):
+            if name not in new_infos:
+                return False
+            if reuse_resources and (name == "resources.arsc" or name.startswith("res/")):
+                return name in patched_res
+            return True
+
+        reused = 0
+        with zipfile.ZipFile(out_apk, 'w') as zip_out:
+            for info in zip_orig.infolist():
+                name = info.filename
+                if is_signature_entry(name):
+                    continue
+                if take_rebuilt(name):
+                    copy_zip_entry_raw(rebuilt_apk, new_infos.pop(name), zip_out)
+                elif reuse_resources or not (name == "resources.arsc" or name.startswith("res/")):
+                    copy_zip_entry_raw(original_apk, info, zip_out)
+                    reused += 1
+                new_infos.pop(name, None)
+            for name, info in new_infos.items():
+                if reuse_resources and (name == "resources.arsc" or name.startswith("res/")):
+                    continue
+                copy_zip_entry_raw(rebuilt_apk, info, zip_out)
+    return reused
+
+SUPPORTED_ABIS = ('armeabi-v7a', 'arm64-v8a', 'x86', 'x86_64')
+
+def load_device_abis(profile_path):
+    """Read a device's supported ABIs, most preferred first, from a profile file
+
+    Accepts JSON ({"abis": [...]} or {"supported_abis": [...]}), `adb shell getprop`
+    output, or a plain comma/whitespace separated list such as ro.product.cpu.abilist.
+    """
+    with open(profile_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    try:
+        profile = json.loads(content)
+    except ValueError:
+        profile = None
+    if isinstance(profile, dict):
+        for key in ("abis", "supported_abis", "supportedAbis", "abilist"):
+            if key in profile:
+                value = profile[key]
+                return value.split(",") if isinstance(value, str) else list(value)
+        raise ValueError(f"No ABI list in device profile {profile_path}")
+    if isinstance(profile, list):
+        return [str(abi) for abi in profile]
+
+    match = re.search(r'\[ro\.product\.cpu\.abilist\]:\s*\[([^\]]*)\]', content)
+    if match:
+        content = match.group(1)
+    return [abi for abi in re.split(r'[,\s]+', content) if abi in SUPPORTED_ABIS]
+
+def apk_abis(apk_path):
+    """Return the ABIs that have a lib/<abi>/ directory in an APK"""
+    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+        return {name.split("/")[1] for name in zip_ref.namelist()
+                if name.startswith("lib/") and name.count("/") >= 2}
+
+def resolve_target_abis(requested_abis, device_abis, available_abis):
+    """Pick the ABIs to keep: explicit --abi values, else the device's preferred shipped ABI"""
+    if requested_abis:
+        return [abi for abi in requested_abis if abi in available_abis]
+    for abi in device_abis or []:
+        if abi in available_abis:
+            return [abi]
+    return []
+
+def filter_apk_abis(apk_path, keep_abis):
+    """Rewrite an APK without the lib/<abi>/ trees of ABIs not in keep_abis
+
+    Returns (entries dropped, bytes dropped). Kept entries are copied raw.
+    """
+    dropped = 0
+    dropped_bytes = 0
+    tmp_path = apk_path + ".abi.part"
+    with zipfile.ZipFile(apk_path, 'r') as zip_in, zipfile.ZipFile(tmp_path, 'w') as zip_out:
+        for info in zip_in.infolist():
+            parts = info.filename.split("/")
+            if parts[0] == "lib" and len(parts) >= 3 and parts[1] not in keep_abis:
+                dropped += 1
+                dropped_bytes += info.compress_size
+                continue
+            copy_zip_entry_raw(apk_path, info, zip_out)
+    os.replace(tmp_path, apk_path)
+    return dropped, dropped_bytes
+
+# Resource rewrite rules per target file: (rule name, pattern, replacement).
+# Each file's rules run as a single alternation, so the file is scanned once.
+RESOURCE_REWRITE_RULES = {
+    "AndroidManifest.xml": {
+        "flags": re.DOTALL,
+        "prefilter": ("com.pairip.licensecheck", "com.android.vending.CHECK_LICENSE"),
+        "rules": [
+            ("license_entries", r'<activity[^>]+com\.pairip\.licensecheck\.LicenseActivity[^<]+/>', ''),
+            ("license_entries", r'<provider[^>]+com\.pairip\.licensecheck\.LicenseContentProvider[^<]+/>', ''),
+            ("check_license_permission",
+             r'<uses-permission[^>]+android:name="com\.android\.vending\.CHECK_LICENSE"[^<]*/>', ''),
+        ],
+    },
+    "file_paths.xml": {
+        "flags": re.IGNORECASE,
+        "prefilter": ("external-path",),
+        "rules": [
+            ("external_pictures_path",
+             r'<external-path\s+name="[^"]*"\s+path="Android/data/[^"]*/files/Pictures"\s*/>',
+             '<external-files-path name="my_images" path="Pictures/" />'),
+        ],
+    },
+}
+
+compiled_rewrite_rules = {}
+
+def get_rewrite_rules(target):
+    """Compile a target's rules into one alternation of named groups (cached)"""
+    if target not in compiled_rewrite_rules:
+        spec = RESOURCE_REWRITE_RULES[target]
+        alternation = "|".join(f"(?P<r{i}>{pattern})" for i, (_, pattern, _) in enumerate(spec["rules"]))
+        compiled_rewrite_rules[target] = (re.compile(alternation, spec["flags"]), spec)
+    return compiled_rewrite_rules[target]
+
+def rewrite_resource_file(path, target):
+    """Apply every rule for target to the file at path in one pass; returns {rule name: count}"""
+    pattern, spec = get_rewrite_rules(target)
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    counts = {}
+    # The prefilter must be at least as permissive as the rules it guards
+    haystack = content.lower() if spec["flags"] & re.IGNORECASE else content
+    literals = [literal.lower() for literal in spec["prefilter"]] if spec["flags"] & re.IGNORECASE else spec["prefilter"]
+    if not any(literal in haystack for literal in literals):
+        return counts
+
+    def replace(match):
+        name, _, replacement = spec["rules"][int(match.lastgroup[1:])]
+        counts[name] = counts.get(name, 0) + 1
+        return replacement
+
+    content = pattern.sub(replace, content)
+    if counts:
+        replace_file_text(path, content)
+    return counts
+
+def find_rewrite_targets(decompile_dir):
+    """Resolve (path, target) pairs by direct lookup instead of walking the resource tree"""
+    targets = []
+    manifest_path = os.path.join(decompile_dir, "AndroidManifest.xml")
+    if os.path.isfile(manifest_path):
+        targets.append((manifest_path, "AndroidManifest.xml"))
+    # resources/<package>/res/xml[-qualifiers]/file_paths.xml
+    pattern = os.path.join(glob.escape(decompile_dir), "resources", "*", "res", "xml*", "file_paths.xml")
+    targets.extend((path, "file_paths.xml") for path in sorted(glob.glob(pattern)))
+    return targets
+
+def rewrite_resources(decompile_dir):
+    """Run the resource rewrite rules over the manifest and file_paths.xml; returns total replacements"""
+    totals = {}
+    targets = find_rewrite_targets(decompile_dir)
+    if not any(target == "AndroidManifest.xml" for _, target in targets):
+        log.warning("AndroidManifest.xml not found")
+    for path, target in targets:
+        try:
+            counts = rewrite_resource_file(path, target)
+        except Exception as e:
+            log.error(f"Failed to patch {path}: {e}")
+            continue
+        for name, count in counts.items():
+            totals[name] = totals.get(name, 0) + count
+        if target == "file_paths.xml" and counts:
+            log.success("Patched file_paths.xml")
+
+    if totals.get("license_entries"):
+        log.success(f"Removed {totals['license_entries']} license check entries")
+    if totals.get("check_license_permission"):
+        log.success("Removed CHECK_LICENSE permission")
+    if not (totals.get("license_entries") or totals.get("check_license_permission")):
+        log.warning("No license check entries or CHECK_LICENSE permission found")
+    if not totals.get("external_pictures_path"):
+        log.warning("No matching <external-path> entries found")
+    return sum(totals.values())
+
+# Smali patching definitions
+NEW_CLINIT_BLOCK = [
+    ".method static constructor <clinit>()V",
+    "    .registers 1",
+    "",
+    "    .line 30",
+    "    const-string v0, \"pairipcorex\"",
+    "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V",
+    "",
+    "    const-string v0, \"pairipcore\"",
+    "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V",
+    "",
+    "    return-void",
+    ".end method"
+]
+
+NEW_VERIFY_SIGNATURE_BLOCK = [
+    ".method static verifySignatureMatches(Ljava/lang/String;)Z",
+    "    .registers 1",
+    "",
+    "    const/4 p0, 0x1",
+    "    return p0",
+    ".end method"
+]
+
+NEW_INITIALIZE_LICENSE_BLOCK = [
+    ".method public initializeLicenseCheck()V",
+    "    .registers 1",
+    "    return-void",
+    ".end method"
+]
+
+NEW_CONNECT_LICENSE_BLOCK = [
+    ".method private connectToLicensingService()V",
+    "    .registers 1",
+    "    return-void",
+    ".end method"
+]
+
+
+def patch_vmrunner_smali(vmrunner_path):
+    """Replace VMRunner.<clinit> so it loads libpairipcorex first; returns True if patched"""
+    with open(vmrunner_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    new_lines = []
+    inside_clinit = False
+    method_start_found = False
+
+    for line in lines:
+        if not inside_clinit and line.strip().startswith('.method') and '<clinit>()V' in line:
+            inside_clinit = True
+            method_start_found = True
+            new_lines.extend(line + '\n' for line in NEW_CLINIT_BLOCK)
+            continue
+
+        if inside_clinit:
+            if line.strip() == '.end method':
+                inside_clinit = False
+            continue
+
+        new_lines.append(line)
+
+    if method_start_found:
+        replace_file_text(vmrunner_path, new_lines)
+    return method_start_found
+
+def patch_license_smali(sig_path):
+    """Stub out the integrity and license methods in SignatureCheck/LicenseClient; returns patched method names"""
+    with open(sig_path, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+
+    new_lines = []
+    replacements = {
+        'verifySignatureMatches': ('verifySignatureMatches(Ljava/lang/String;)Z', NEW_VERIFY_SIGNATURE_BLOCK),
+        'initializeLicenseCheck': ('initializeLicenseCheck()V', NEW_INITIALIZE_LICENSE_BLOCK),
+        'connectToLicensingService': ('connectToLicensingService()V', NEW_CONNECT_LICENSE_BLOCK),
+    }
+    patched = set()
+
+    i = 0
+    while i < len(lines):
+        stripped = lines[i].strip()
+
+        if 'verifyIntegrity' not in patched and stripped.startswith('.method') and 'verifyIntegrity(Landroid/content/Context;)V' in stripped:
+            patched.add('verifyIntegrity')
+            new_lines.append(lines[i])
+            i += 1
+            new_lines.append('    .registers 1\n')
+            new_lines.append('    return-void\n')
+            new_lines.append('.end method\n')
+            while i < len(lines) and not lines[i].strip().startswith('.end method'):
+                i += 1
+            i += 1
+            continue
+
+        replaced = False
+        for method, (signature, block) in replacements.items():
+            if method not in patched and stripped.startswith('.method') and signature in stripped:
+                patched.add(method)
+                new_lines.extend(line + '\n' for line in block)
+                while i < len(lines) and not lines[i].strip().startswith('.end method'):
+                    i += 1
+                i += 1
+                replaced = True
+                break
+        if replaced:
+            continue
+
+        new_lines.append(lines[i])
+        i += 1
+
+    if patched:
+        replace_file_text(sig_path, new_lines)
+    return patched
+
+def pairip_lib_abis(apk_path):
+    """List the ABIs whose lib/<abi>/ directory in the APK ships libpairipcore.so"""
+    architectures = []
+    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+        for file in zip_ref.namelist():
+            if file.startswith("lib/") and file.endswith("libpairipcore.so"):
+                architectures.append(file.split("/")[1])
+    return architectures
+
+def copy_file_range_all(src_path, dest_path):
+    """Copy src_path to dest_path inside the kernel with os.copy_file_range"""
+    with open(src_path, 'rb') as src, open(dest_path, 'wb') as dst:
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if not copied:
+                raise OSError(f"copy_file_range stopped with {remaining} bytes left")
+            remaining -= copied
+
+def stage_file(src_path, dest_path):
+    """Place src_path at dest_path through a temp name and a rename; returns the method used
+
+    A hardlink is tried first, then copy_file_range (same-filesystem reflinks or
+    in-kernel copies) and finally a plain copy. dest_path's old inode is never
+    written into, so a shadow tree's shared files stay intact.
+    """
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.part"
+    method = "copy"
+    try:
+        os.link(src_path, tmp_path)
+        method = "hardlink"
+    except OSError:
+        if hasattr(os, "copy_file_range"):
+            try:
+                copy_file_range_all(src_path, tmp_path)
+                method = "copy_file_range"
+            except OSError:
+                pass
+        if method == "copy":
+            shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+    return method
+
+def stage_native_libs(lib_root, native_libs, abis):
+    """Stage native_libs into lib_root/<abi> for every ABI in abis, one thread per ABI
+
+    abis come from the merged APK's central directory, so target directories are
+    resolved without walking the tree. Each staged file is checked against its
+    source by size and, unless it is the same inode, by SHA-256 in the same task.
+    Returns {abi: {"seconds": ..., "files": {name: method}}}; raises ToolError on
+    a failed or mismatching copy.
+    """
+    targets = []
+    for abi in dict.fromkeys(abis):
+        if abi not in SUPPORTED_ABIS:
+            log.warning(f"Skipping incompatible architecture: {abi}")
+        elif not os.path.isdir(os.path.join(lib_root, abi)):
+            log.warning(f"Skipping {abi}: lib/{abi} was not decoded")
+        else:
+            targets.append(abi)
+    if not targets:
+        return {}
+    sources = {path: os.stat(path) for path in native_libs}
+    lib_dev = os.stat(lib_root).st_dev
+    # Hardlinks skip the hash check; hash up front only what will have to be copied
+    digests = {path: file_sha256(path) for path, st in sources.items() if st.st_dev != lib_dev}
+
+    def stage_abi(abi):
+        start = time.perf_counter()
+        files = {}
+        for src_path, src_stat in sources.items():
+            so_file = os.path.basename(src_path)
+            dest_path = os.path.join(lib_root, abi, so_file)
+            try:
+                files[so_file] = stage_file(src_path, dest_path)
+                st = os.stat(dest_path)
+                if st.st_size != src_stat.st_size:
+                    raise ToolError(f"Staged {so_file} in {abi} is {st.st_size} bytes, expected {src_stat.st_size}",
+                                    stage="patch")
+                if (st.st_dev, st.st_ino) != (src_stat.st_dev, src_stat.st_ino):
+                    expected = digests.get(src_path) or file_sha256(src_path)
+                    if file_sha256(dest_path) != expected:
+                        raise ToolError(f"Staged {so_file} in {abi} does not match its source", stage="patch")
+            except OSError as e:
+                raise ToolError(f"Failed to stage {so_file} to {abi}: {e}", stage="patch") from e
+        return abi, {"seconds": round(time.perf_counter() - start, 4), "files": files}
+
+    with ThreadPool(len(targets)) as pool:
+        return dict(pool.map(stage_abi, targets))
+
+def patch_files(base_dir, native_libs, architectures):
+    """Apply patches to the decompiled files
+
+    native_libs are the replacement .so files to stage into every lib/<abi> directory
+    listed in architectures. Returns {"patched": [...], "abis": [...], "native_libs":
+    {abi: {"seconds": ..., "files": {name: method}}}}; raises ToolError if a
+    replacement library is missing or a staged copy does not match it, and
+    StageError if the smali tree cannot be read.
+    """
+    smali_base_dir = os.path.join(base_dir, 'smali')
+    base_lib_dir = os.path.join(base_dir, 'root/lib')
     
-    # Step 2: Create libFirebaseCppApp.so
-    start_time = time.time()
-    log.header("Step 2/11: Creating libFirebaseCppApp.so")
-    if not os.path.exists("libFirebaseCppApp.so"):
-        if os.path.exists("base.apk"):
-            shutil.copy("base.apk", "libFirebaseCppApp.so")
-            log.success("Created libFirebaseCppApp.so from base.apk")
+    log.header("Applying patches to decompiled files")
+
+    log.subheader("Verifying native library architectures...")
+    if architectures:
+        log.success(f"Found architectures: {', '.join(architectures)}")
+    else:
+        log.warning("No native libraries found in APK")
+
+    # Apply Smali patches
+    log.subheader("Patching protection code...")
+    stop_spinner = start_spinner("Patching Smali")
+
+    vmrunner_patched = False
+    sigcheck_patched = False
+    verify_signature_patched = False
+    initialize_license_patched = False
+    connect_license_patched = False
+    
+    try:
+        smali_dirs = [d for d in os.listdir(smali_base_dir) if d.startswith('classes') and os.path.isdir(os.path.join(smali_base_dir, d))]
+    except OSError as e:
+        stop_spinner()
+        raise StageError(f"Could not list smali directories: {e}", stage="patch") from e
+    
+    if not smali_dirs:
+        stop_spinner()
+        log.warning("No smali/classes* directories found, skipping Smali patching")
+    else:
+        for smali_dir in smali_dirs:
+            pairip_dir = os.path.join(smali_base_dir, smali_dir, 'com/pairip')
+            if not os.path.exists(pairip_dir):
+                continue
+
+            for root, dirs, files in os.walk(pairip_dir):
+                if 'VMRunner.smali' in files:
+                    try:
+                        if patch_vmrunner_smali(os.path.join(root, 'VMRunner.smali')):
+                            vmrunner_patched = True
+                    except Exception as e:
+                        log.error(f"Failed to patch VMRunner.smali: {e}")
+
+                if 'SignatureCheck.smali' in files or 'LicenseClient.smali' in files:
+                    smali_file = 'LicenseClient.smali' if 'LicenseClient.smali' in files else 'SignatureCheck.smali'
+                    try:
+                        patched_methods = patch_license_smali(os.path.join(root, smali_file))
+                    except Exception as e:
+                        log.error(f"Failed to patch {smali_file}: {e}")
+                        continue
+                    sigcheck_patched = sigcheck_patched or 'verifyIntegrity' in patched_methods
+                    verify_signature_patched = verify_signature_patched or 'verifySignatureMatches' in patched_methods
+                    initialize_license_patched = initialize_license_patched or 'initializeLicenseCheck' in patched_methods
+                    connect_license_patched = connect_license_patched or 'connectToLicensingService' in patched_methods
+
+        stop_spinner()
+
+        if vmrunner_patched:
+            log.success("Patched VMRunner.smali")
+        if sigcheck_patched:
+            log.success("Patched verifyIntegrity")
+        if verify_signature_patched:
+            log.success("Patched verifySignatureMatches")
+        if initialize_license_patched:
+            log.success("Patched initializeLicenseCheck")
+        if connect_license_patched:
+            log.success("Patched connectToLicensingService")
+        if not (vmrunner_patched or sigcheck_patched or verify_signature_patched or initialize_license_patched or connect_license_patched):
+            log.warning("No Smali files patched")
+
+    # Stage the replacement .so files
+    log.subheader("Staging native libraries...")
+    missing = [path for path in native_libs if not os.path.exists(path)]
+    if missing:
+        raise ToolError(f"Missing .so files: {', '.join(missing)}", stage="patch")
+    staged = stage_native_libs(base_lib_dir, native_libs, architectures)
+    for abi, entry in staged.items():
+        methods = ", ".join(f"{name} ({method})" for name, method in entry["files"].items())
+        log.success(f"Staged {methods} into {abi} in {entry['seconds'] * 1000:.0f} ms")
+    arch_types = list(staged)
+    if not arch_types:
+        log.warning("No library directories found containing libpairipcore.so")
+    else:
+        log.success(f"Libraries staged and verified in {len(arch_types)} architecture(s): {', '.join(arch_types)}")
+    
+    patched = [name for name, done in (
+        ("VMRunner", vmrunner_patched), ("verifyIntegrity", sigcheck_patched),
+        ("verifySignatureMatches", verify_signature_patched), ("initializeLicenseCheck", initialize_license_patched),
+        ("connectToLicensingService", connect_license_patched)) if done]
+    return {"patched": patched, "abis": arch_types, "native_libs": staged}
+
+# Decoded instruction sequences of the replacement smali bodies: const-string and
+# invoke operands are resolved to their string and method references.
+LOAD_LIBRARY = "Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V"
+EXPECTED_METHOD_CODE = {
+    ("VMRunner", "<clinit>"): [("const-string", "pairipcorex"), ("invoke-static", LOAD_LIBRARY),
+                               ("const-string", "pairipcore"), ("invoke-static", LOAD_LIBRARY), ("return-void",)],
+    (None, "verifyIntegrity"): [("return-void",)],
+    (None, "verifySignatureMatches"): [("const/4", 1), ("return",)],
+    (None, "initializeLicenseCheck"): [("return-void",)],
+    (None, "connectToLicensingService"): [("return-void",)],
+}
+# Names patch_files reports for each verified method
+PATCHED_METHOD_NAMES = {"<clinit>": "VMRunner"}
+APK_SIG_BLOCK_MAGIC = b"APK Sig Block 42"
+APK_SIGNATURE_SCHEME_V2_ID = 0x7109871a
+APK_SIGNATURE_SCHEME_V3_ID = 0xf05368c0
+MAX_SIGNING_BLOCK_SIZE = 16 * 1024 * 1024
+# zipalign boundary for stored entries. The merge requests extractNativeLibs, so the
+# installer extracts native libraries and page (4096) alignment is not required.
+NATIVE_LIB_ALIGNMENT = 4
+
+def dex_string(data, string_ids_off, index):
+    """Decode one entry of a dex string table"""
+    (string_data_off,) = struct.unpack_from('<I', data, string_ids_off + index * 4)
+    _, start = read_uleb128(data, string_data_off)
+    return data[start:data.index(b"\0", start)].decode('utf-8', errors='replace')
+
+def dex_method_reference(data, header, method_idx):
+    """Format a method_ids entry as Lclass;->name(params)return"""
+    string_ids_off, type_ids_off, proto_ids_off, method_ids_off = header
+
+    def type_name(type_idx):
+        (string_idx,) = struct.unpack_from('<I', data, type_ids_off + type_idx * 4)
+        return dex_string(data, string_ids_off, string_idx)
+
+    class_idx, proto_idx, name_idx = struct.unpack_from('<HHI', data, method_ids_off + method_idx * 8)
+    _, return_type_idx, parameters_off = struct.unpack_from('<III', data, proto_ids_off + proto_idx * 12)
+    params = []
+    if parameters_off:
+        (size,) = struct.unpack_from('<I', data, parameters_off)
+        params = [type_name(idx) for idx in struct.unpack_from(f'<{size}H', data, parameters_off + 4)]
+    return f"{type_name(class_idx)}->{dex_string(data, string_ids_off, name_idx)}({''.join(params)}){type_name(return_type_idx)}"
+
+def decode_method_code(data, header, code_off):
+    """Decode the few instruction formats the replacement bodies use
+
+    Any other opcode ends decoding with an ("opcode", value) entry, which never
+    matches an expected body.
+    """
+    (insns_size,) = struct.unpack_from('<I', data, code_off + 12)
+    units = struct.unpack_from(f'<{insns_size}H', data, code_off + 16)
+    decoded = []
+    pc = 0
+    while pc < len(units):
+        opcode = units[pc] & 0xff
+        if opcode == 0x0e:
+            decoded.append(("return-void",))
+            pc += 1
+        elif opcode == 0x0f:
+            decoded.append(("return",))
+            pc += 1
+        elif opcode == 0x12:
+            value = units[pc] >> 12
+            decoded.append(("const/4", value - 16 if value > 7 else value))
+            pc += 1
+        elif opcode in (0x1a, 0x1b):
+            string_idx = units[pc + 1] if opcode == 0x1a else units[pc + 1] | (units[pc + 2] << 16)
+            decoded.append(("const-string", dex_string(data, header[0], string_idx)))
+            pc += 2 if opcode == 0x1a else 3
+        elif opcode in (0x71, 0x77):
+            decoded.append(("invoke-static", dex_method_reference(data, header, units[pc + 1])))
+            pc += 3
         else:
-            log.error("base.apk not found to create libFirebaseCppApp.so")
-            sys.exit(1)
+            decoded.append(("opcode", opcode))
+            break
+    return decoded
+
+def dex_protection_methods(data):
+    """Yield (class simple name, method name, decoded code) for methods of com/pairip protection classes"""
+    if data[:4] != b"dex\n":
+        raise ValueError("Not a dex file")
+    string_ids_off, type_ids_off = struct.unpack_from('<I4xI', data, 0x3c)
+    (proto_ids_off,) = struct.unpack_from('<I', data, 0x4c)
+    (method_ids_off,) = struct.unpack_from('<I', data, 0x5c)
+    class_defs_size, class_defs_off = struct.unpack_from('<II', data, 0x60)
+    header = (string_ids_off, type_ids_off, proto_ids_off, method_ids_off)
+    for i in range(class_defs_size):
+        class_idx, class_data_off = struct.unpack_from('<I20xI', data, class_defs_off + i * 32)
+        (string_idx,) = struct.unpack_from('<I', data, type_ids_off + class_idx * 4)
+        descriptor = dex_string(data, string_ids_off, string_idx)
+        simple_name = descriptor.rstrip(';').rsplit('/', 1)[-1]
+        if not descriptor.startswith("Lcom/pairip/") or simple_name not in PROTECTION_CLASSES or not class_data_off:
+            continue
+        offset = class_data_off
+        sizes = []
+        for _ in range(4):
+            value, offset = read_uleb128(data, offset)
+            sizes.append(value)
+        for _ in range((sizes[0] + sizes[1]) * 2):
+            _, offset = read_uleb128(data, offset)
+        for count in sizes[2:]:
+            method_idx = 0
+            for _ in range(count):
+                idx_diff, offset = read_uleb128(data, offset)
+                _, offset = read_uleb128(data, offset)
+                code_off, offset = read_uleb128(data, offset)
+                method_idx += idx_diff
+                if not code_off:
+                    continue
+                (name_idx,) = struct.unpack_from('<I', data, method_ids_off + method_idx * 8 + 4)
+                method_name = dex_string(data, string_ids_off, name_idx)
+                if (simple_name, method_name) in EXPECTED_METHOD_CODE or (None, method_name) in EXPECTED_METHOD_CODE:
+                    yield simple_name, method_name, decode_method_code(data, header, code_off)
+
+def read_length_prefixed(buf, offset):
+    """Return (value, next offset) of a uint32 length-prefixed field, checking bounds"""
+    if offset + 4 > len(buf):
+        raise ValueError("truncated length prefix")
+    (length,) = struct.unpack_from('<I', buf, offset)
+    end = offset + 4 + length
+    if end > len(buf):
+        raise ValueError("length prefix runs past its container")
+    return buf[offset + 4:end], end
+
+def read_length_prefixed_sequence(buf):
+    """Split a sequence of uint32 length-prefixed items"""
+    items = []
+    offset = 0
+    while offset < len(buf):
+        item, offset = read_length_prefixed(buf, offset)
+        items.append(item)
+    return items
+
+def read_apk_signing_block(zip_ref):
+    """Return {block id: value} from the APK Signing Block, or None if the APK has none"""
+    cd_offset = zip_ref.start_dir
+    if cd_offset < 32:
+        return None
+    fp = zip_ref.fp
+    fp.seek(cd_offset - 24)
+    footer = fp.read(24)
+    if footer[8:] != APK_SIG_BLOCK_MAGIC:
+        return None
+    (block_size,) = struct.unpack('<Q', footer[:8])
+    if block_size < 32 or block_size > min(cd_offset - 8, MAX_SIGNING_BLOCK_SIZE):
+        raise ValueError(f"implausible signing block size {block_size}")
+    fp.seek(cd_offset - block_size - 8)
+    block = memoryview(fp.read(block_size + 8))
+    if struct.unpack_from('<Q', block, 0)[0] != block_size:
+        raise ValueError("signing block size fields disagree")
+    pairs = {}
+    offset = 8
+    end = len(block) - 24
+    while offset < end:
+        if offset + 12 > end:
+            raise ValueError("truncated signing block entry")
+        (length,) = struct.unpack_from('<Q', block, offset)
+        if length < 4 or offset + 8 + length > end:
+            raise ValueError("signing block entry runs past the block")
+        (block_id,) = struct.unpack_from('<I', block, offset + 8)
+        pairs[block_id] = block[offset + 12:offset + 8 + length]
+        offset += 8 + length
+    return pairs
+
+def check_v2_signature(value):
+    """Parse an APK Signature Scheme v2 block; returns the number of signers"""
+    signers = read_length_prefixed_sequence(read_length_prefixed(value, 0)[0])
+    if not signers:
+        raise ValueError("no signers")
+    for signer in signers:
+        signed_data, offset = read_length_prefixed(signer, 0)
+        signatures, offset = read_length_prefixed(signer, offset)
+        public_key, _ = read_length_prefixed(signer, offset)
+        digests, offset = read_length_prefixed(signed_data, 0)
+        certificates, _ = read_length_prefixed(signed_data, offset)
+        if not read_length_prefixed_sequence(digests) or not read_length_prefixed_sequence(certificates):
+            raise ValueError("signer without digests or certificates")
+        if not read_length_prefixed_sequence(signatures) or not len(public_key):
+            raise ValueError("signer without signatures or public key")
+    return len(signers)
+
+def check_zip_structure(path):
+    """Validate an archive's central directory and local headers without reading entry data
+
+    Replaces ZipFile.testzip(), which inflates every entry: this costs one small
+    read per entry whatever the archive size, and handles zip64. Entry CRCs are
+    still checked when the data is read. Returns the number of entries.
+    """
+    with zipfile.ZipFile(path, 'r') as zip_ref:
+        infos = zip_ref.infolist()
+        for info in infos:
+            try:
+                data_offset = zip_entry_data_offset(zip_ref, info)
+            except ValueError as e:
+                raise zipfile.BadZipFile(str(e)) from e
+            if data_offset + info.compress_size > zip_ref.start_dir:
+                raise zipfile.BadZipFile(f"{info.filename} runs into the central directory")
+    return len(infos)
+
+def verify_output_apk(apk_path, patched=None, abis=None, native_libs=()):
+    """Check a finished APK through its central directory; returns a report with a list of failures
+
+    patched and abis are what patch_files reported (None checks whatever is present);
+    native_libs are the source files whose sizes the staged copies must match.
+    """
+    start_time = time.perf_counter()
+    failures = []
+    checks = 0
+    with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+        names = zip_ref.NameToInfo
+
+        # Replacement method bodies
+        verified = set()
+        for name in names:
+            if not DEX_NAME_PATTERN.match(name):
+                continue
+            data = read_entry_bounded(zip_ref, names[name])
+            if PAIRIP_TYPE_PREFIX not in data:
+                continue
+            for class_name, method_name, code in dex_protection_methods(data):
+                expected = EXPECTED_METHOD_CODE.get((class_name, method_name)) or EXPECTED_METHOD_CODE.get((None, method_name))
+                checks += 1
+                if code != expected:
+                    failures.append(f"{name}: {class_name}.{method_name} does not match the replacement body")
+                verified.add(PATCHED_METHOD_NAMES.get(method_name, method_name))
+        for method_name in set(patched or ()) - verified:
+            checks += 1
+            failures.append(f"patched method {method_name} not found in any dex")
+
+        # License manifest entries
+        if "AndroidManifest.xml" in names:
+            manifest = read_entry_bounded(zip_ref, names["AndroidManifest.xml"])
+            for marker in LICENSE_MANIFEST_MARKERS:
+                checks += 1
+                if marker.encode('utf-8') in manifest or marker.encode('utf-16-le') in manifest:
+                    failures.append(f"AndroidManifest.xml still references {marker}")
+        else:
+            failures.append("AndroidManifest.xml missing")
+
+        # Replacement native libraries in every protected ABI
+        if abis is None:
+            abis = sorted(name.split("/")[1] for name in names
+                          if name.startswith("lib/") and name.endswith("/libpairipcore.so"))
+        expected_sizes = {os.path.basename(path): os.path.getsize(path) for path in native_libs if os.path.exists(path)}
+        for abi in abis:
+            for lib_name in (PAIRIP_LIB, FIREBASE_LIB):
+                checks += 1
+                info = names.get(f"lib/{abi}/{lib_name}")
+                if info is None:
+                    failures.append(f"lib/{abi}/{lib_name} missing")
+                    continue
+                if lib_name in expected_sizes and info.file_size != expected_sizes[lib_name]:
+                    failures.append(f"lib/{abi}/{lib_name} is {info.file_size} bytes, expected {expected_sizes[lib_name]}")
+                if info.compress_type == zipfile.ZIP_STORED:
+                    offset = zip_entry_data_offset(zip_ref, info)
+                    if offset % NATIVE_LIB_ALIGNMENT:
+                        failures.append(f"lib/{abi}/{lib_name} is stored at offset {offset}, not {NATIVE_LIB_ALIGNMENT}-byte aligned")
+
+        # APK Signature Scheme v2 block
+        checks += 1
+        try:
+            pairs = read_apk_signing_block(zip_ref)
+            if pairs is None:
+                failures.append("no APK Signing Block")
+            elif APK_SIGNATURE_SCHEME_V2_ID not in pairs:
+                failures.append("APK Signing Block has no v2 signature")
+            else:
+                check_v2_signature(pairs[APK_SIGNATURE_SCHEME_V2_ID])
+        except (ValueError, struct.error) as e:
+            failures.append(f"APK Signing Block does not parse: {e}")
+    return {"apk": apk_path, "checks": checks, "failures": failures,
+            "seconds": round(time.perf_counter() - start_time, 3)}
+
+def is_v2_signed(apk_path):
+    """Check whether an APK carries an APK Signature Scheme v2 block"""
+    try:
+        with zipfile.ZipFile(apk_path, 'r') as zip_ref:
+            pairs = read_apk_signing_block(zip_ref)
+    except (OSError, zipfile.BadZipFile, ValueError, struct.error):
+        return False
+    return bool(pairs) and APK_SIGNATURE_SCHEME_V2_ID in pairs
+
+def print_verify_report(report):
+    """Print one verification report in the usual log format"""
+    name = os.path.basename(report["apk"])
+    if report["failures"]:
+        log.error(f"{name}: {len(report['failures'])} of {report['checks']} checks failed ({report['seconds']:.2f}s)")
+        for failure in report["failures"]:
+            log.info(f"  {failure}")
     else:
-        log.success("libFirebaseCppApp.so already exists")
-    log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+        log.success(f"{name}: {report['checks']} checks passed ({report['seconds']:.2f}s)")
+
+def verify_main(argv):
+    """Entry point for the verify command"""
+    parser = argparse.ArgumentParser(prog="patch.py verify",
+                                     description="Check patched APKs without installing them")
+    parser.add_argument("apks", nargs="+", help="patched .apk files")
+    parser.add_argument("--json", action="store_true", help="print one JSON report per line")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for apk_path in args.apks:
+        try:
+            report = verify_output_apk(apk_path)
+        except (OSError, zipfile.BadZipFile, ValueError, struct.error) as e:
+            report = {"apk": apk_path, "checks": 0, "failures": [str(e)], "seconds": 0.0}
+        failed = failed or bool(report["failures"])
+        if args.json:
+            print(json.dumps(report, sort_keys=True))
+        else:
+            print_verify_report(report)
+    return 1 if failed else 0
+
+TIMING_DB_PATH = os.path.join(CACHE_DIR, "timings.sqlite")
+# Jobs used to fit the cost model
+TIMING_HISTORY = 200
+
+def count_files(path):
+    """Count regular files under path with os.scandir"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += 1
+        except OSError:
+            pass
+    return total
+
+def self_peak_rss_kb():
+    """Return the peak resident set size of this process so far in KiB, if known"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere
+    return peak // 1024 if platform.system() == "Darwin" else peak
+
+def current_rss_kb():
+    """Return the current resident set size of this process in KiB (Linux only)"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def job_peak_rss_kb(self_peak_before, children_peak):
+    """Peak RSS of one job in KiB: its largest child, and this process if its peak rose during the job
+
+    This process's lifetime peak only belongs to the job when it grew after the
+    job started; otherwise the current RSS is the best bound available.
+    """
+    self_peak = self_peak_rss_kb()
+    if self_peak is None or self_peak_before is None or self_peak <= self_peak_before:
+        self_peak = current_rss_kb()
+    values = [value for value in (self_peak, children_peak) if value]
+    return max(values) if values else None
+
+def open_timing_db():
+    """Open (and create if needed) the stage-timing database"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    db = sqlite3.connect(TIMING_DB_PATH, timeout=10)
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            input TEXT, created REAL, input_bytes INTEGER, dex_count INTEGER,
+            smali_files INTEGER, resource_files INTEGER, peak_rss_kb INTEGER, total_seconds REAL
+        );
+        CREATE TABLE IF NOT EXISTS stages (
+            job_id INTEGER REFERENCES jobs(id), stage TEXT, seconds REAL
+        );
+        CREATE TABLE IF NOT EXISTS jvm_launches (
+            job_id INTEGER REFERENCES jobs(id), stage TEXT, flags TEXT, cds TEXT, startup_saving_ms REAL
+        );
+    """)
+    return db
+
+def record_job_timings(apks_file, job_stats, stage_times, jvm_launches=None):
+    """Persist one job's stage timings, JVM launch profiles, input sizes and peak memory"""
+    db = open_timing_db()
+    try:
+        with db:
+            cursor = db.execute(
+                "INSERT INTO jobs (input, created, input_bytes, dex_count, smali_files, resource_files, "
+                "peak_rss_kb, total_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (os.path.basename(apks_file), time.time(), job_stats.get("input_bytes"), job_stats.get("dex_count"),
+                 job_stats.get("smali_files"), job_stats.get("resource_files"), job_stats.get("peak_rss_kb"),
+                 sum(stage_times.values())))
+            db.executemany("INSERT INTO stages (job_id, stage, seconds) VALUES (?, ?, ?)",
+                           [(cursor.lastrowid, stage, seconds) for stage, seconds in stage_times.items()])
+            db.executemany("INSERT INTO jvm_launches (job_id, stage, flags, cds, startup_saving_ms) VALUES (?, ?, ?, ?, ?)",
+                           [(cursor.lastrowid, stage, " ".join(launch["flags"]), launch["cds"], launch["startup_saving_ms"])
+                            for stage, launch in (jvm_launches or {}).items()])
+    finally:
+        db.close()
+
+def fit_cost_model():
+    """Fit seconds = a + b * input_bytes per stage by least squares over recent jobs
+
+    Returns {stage: (a, b)}, or {} when there is no history yet.
+    """
+    try:
+        db = open_timing_db()
+    except (OSError, sqlite3.Error):
+        return {}
+    try:
+        rows = db.execute(
+            "SELECT s.stage, j.input_bytes, s.seconds FROM stages s JOIN "
+            "(SELECT id, input_bytes FROM jobs ORDER BY id DESC LIMIT ?) j ON s.job_id = j.id",
+            (TIMING_HISTORY,)).fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        db.close()
+
+    samples = {}
+    for stage, size, seconds in rows:
+        samples.setdefault(stage, []).append((size or 0, seconds))
+    model = {}
+    for stage, points in samples.items():
+        n = len(points)
+        mean_x = sum(x for x, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_x = sum((x - mean_x) ** 2 for x, _ in points)
+        if var_x == 0:
+            model[stage] = (mean_y, 0.0)
+        else:
+            b = max(sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x, 0.0)
+            model[stage] = (mean_y - b * mean_x, b)
+    return model
+
+def predict_stage_times(model, input_bytes):
+    """Predict per-stage seconds for an input of the given size"""
+    return {stage: max(a + b * input_bytes, 0.05) for stage, (a, b) in model.items()}
+
+def order_jobs(inputs, model, order):
+    """Order batch inputs by predicted cost: "longest" first, "shortest" first, or as given"""
+    if order == "given" or len(inputs) < 2:
+        return list(inputs)
+
+    def predicted(path):
+        try:
+            return sum(predict_stage_times(model, os.path.getsize(path)).values()) if model else os.path.getsize(path)
+        except OSError:
+            return 0
+    return sorted(inputs, key=predicted, reverse=(order == "longest"))
+
+class StageTracker:
+    """Collects per-stage wall time and drives the progress bar
+
+    With a cost model the bar is measured in predicted seconds, so its ETA reflects
+    each stage's historical cost; without history it falls back to one unit per stage.
+    """
+    STAGES = ("extract", "firebase_lib", "clean", "merge", "prepare", "decompile",
+              "resources", "patch", "xml_preprocess", "build", "sign", "verify")
+
+    def __init__(self, estimates=None):
+        self.estimates = estimates if estimates and all(stage in estimates for stage in self.STAGES) else None
+        self.times = {}
+        if self.estimates:
+            # The bar advances by these rounded shares, so the total is their sum
+            self.shares = {stage: round(self.estimates[stage], 1) for stage in self.STAGES}
+            self.progress = log.create_progress_bar("main", sum(self.shares.values()), "Patching process (s)")
+        else:
+            self.shares = dict.fromkeys(self.STAGES, 1)
+            self.progress = log.create_progress_bar("main", len(self.STAGES), "Patching process")
+
+    def finish(self, stage, start_time):
+        """Record a finished stage and advance the progress bar by its expected share"""
+        self.times[stage] = self.times.get(stage, 0.0) + time.time() - start_time
+        self.progress.update(self.shares[stage])
+
+    def close(self):
+        """Close the progress bar"""
+        log.close_progress("main")
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+APKEDITOR_JAR = "APKEditor-1.4.3.jar"
+SIGNER_JAR = "uber-apk-signer.jar"
+PAIRIP_LIB = "libpairipcorex.so"
+FIREBASE_LIB = "libFirebaseCppApp.so"
+# Intermediate files a job leaves in its work directory
+JOB_LEFTOVERS = (
+    "base.apk", "merged_app.apk", "out.apk",
+    "out-aligned-debugSigned.apk", "out-aligned-signed.apk",
+    "out-debugSigned.apk", "out-signed.apk", DECOMPILE_DIR_NAME,
+    "slim_app.apk", "out_slim.apk", "splits"
+)
+
+JAVA_HEAP_MIN = 2 * 1024 * 1024 * 1024
+# Fraction of available memory the JVM heap may take for very large bundles
+JAVA_HEAP_MEMORY_SHARE = 0.75
+
+def java_heap_option(apks_file):
+    """Pick -Xmx for the bundled jars: 2 GB, or twice the input for multi-GB bundles when memory allows"""
+    try:
+        wanted = 2 * os.path.getsize(apks_file)
+    except OSError:
+        wanted = 0
+    heap = max(JAVA_HEAP_MIN, wanted)
+    available = get_available_memory()
+    if available:
+        heap = max(JAVA_HEAP_MIN, min(heap, int(available * JAVA_HEAP_MEMORY_SHARE)))
+    return f"-Xmx{heap // (1024 * 1024)}m"
+
+CDS_DIR = os.path.join(CACHE_DIR, "cds")
+CDS_INDEX_PATH = os.path.join(CDS_DIR, "index.json")
+# Dynamic AppCDS archives (-XX:ArchiveClassesAtExit) need JDK 13 or newer
+CDS_MIN_JAVA = 13
+# Launch flags per stage. Merge and sign are short launches, so C1 only and the
+# serial collector start fastest; decompile and build run long enough for C2 and
+# the parallel collector to pay off, and start with a larger heap to skip the
+# early resize cycles (ergonomics clamp it to -Xmx)
+JVM_STAGE_FLAGS = {
+    "merge": ("-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC"),
+    "decompile": ("-XX:+UseParallelGC", "-XX:InitialRAMPercentage=25"),
+    "build": ("-XX:+UseParallelGC", "-XX:InitialRAMPercentage=25"),
+    "sign": ("-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC"),
+}
+# Per-stage flags use -XX:InitialRAMPercentage, which older JVMs reject
+JVM_STAGE_FLAGS_MIN_JAVA = 10
+# Replays of a stage's own command per arm when timing a new AppCDS archive
+CDS_REPLAY_RUNS = 1
+
+java_runtime_cache = {}
+jar_digest_cache = {}
+cds_lock = threading.Lock()
+
+def java_runtime(env=None):
+    """Return (major version, runtime key) of the java on PATH; (0, None) when it cannot be run"""
+    java = shutil.which("java", path=(env or os.environ).get("PATH"))
+    if not java:
+        return 0, None
+    java = os.path.realpath(java)
+    with cds_lock:
+        if java in java_runtime_cache:
+            return java_runtime_cache[java]
+    try:
+        banner = subprocess.run([java, "-version"], capture_output=True, text=True, env=env, timeout=60).stderr
+    except (OSError, subprocess.SubprocessError):
+        banner = ""
+    # "Picked up _JAVA_OPTIONS" changes with the heap option, not with the runtime
+    banner = "\n".join(line for line in banner.splitlines() if not line.startswith("Picked up"))
+    match = re.search(r'version "(\d+)(?:\.(\d+))?', banner)
+    runtime = (0, None)
+    if match:
+        major = int(match.group(1))
+        if major == 1 and match.group(2):
+            major = int(match.group(2))
+        runtime = (major, hashlib.sha256(f"{java}\n{banner}".encode()).hexdigest()[:16])
+    with cds_lock:
+        java_runtime_cache[java] = runtime
+    return runtime
+
+def jar_digest(jar):
+    """SHA-256 of a jar, computed once per process while its stamp is unchanged"""
+    key = (os.path.realpath(jar), tuple(file_stamp(jar)))
+    with cds_lock:
+        if key in jar_digest_cache:
+            return jar_digest_cache[key]
+    digest = file_sha256(jar)
+    with cds_lock:
+        jar_digest_cache[key] = digest
+    return digest
+
+def cds_archive_path(jar, stage, runtime_key):
+    """Return the AppCDS archive path for one jar build, stage and JDK build
+
+    The JVM rejects an archive whose class path differs from the one it was dumped
+    with, so the jar's location and mtime are part of the key next to its hash.
+    """
+    stamp = file_stamp(jar)
+    material = f"{jar_digest(jar)}|{os.path.realpath(jar)}|{stamp[0]}|{stamp[1]}"
+    name = os.path.basename(jar).rsplit('.', 1)[0]
+    return os.path.join(CDS_DIR, f"{name}-{stage}-{hashlib.sha256(material.encode()).hexdigest()[:16]}-{runtime_key}.jsa")
+
+def load_cds_index():
+    """Load the AppCDS index (measured startup savings and runtimes that cannot dump)"""
+    try:
+        with open(CDS_INDEX_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def update_cds_index(name, entry):
+    """Atomically record one archive's entry in the AppCDS index"""
+    with cds_lock:
+        index = load_cds_index()
+        index[name] = entry
+        os.makedirs(CDS_DIR, exist_ok=True)
+        tmp_path = CDS_INDEX_PATH + f".{os.getpid()}.{threading.get_ident()}.part"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, CDS_INDEX_PATH)
+
+def measure_cds_saving(jar, flags, archive, replay, cwd=None, env=None):
+    """Time a replay of a stage's command without and with archive; returns the saving in ms, or None
+
+    replay(output_dir) returns the stage's arguments writing into output_dir, so
+    both arms load the classes the stage really uses.
+    """
+    probe_root = tempfile.mkdtemp(prefix=".cds-probe-", dir=cwd)
+    try:
+        def best_time(extra):
+            best = None
+            for _ in range(CDS_REPLAY_RUNS):
+                output_dir = tempfile.mkdtemp(dir=probe_root)
+                options = "".join(f'"{flag}" ' for flag in [*flags, *extra])
+                start = time.perf_counter()
+                try:
+                    result = subprocess.run(f'java {options}-jar "{jar}" {replay(output_dir)}', shell=True,
+                                            capture_output=True, cwd=cwd, env=env, timeout=1800)
+                except (OSError, subprocess.SubprocessError):
+                    return None
+                elapsed = time.perf_counter() - start
+                discard_path(output_dir)
+                if result.returncode != 0:
+                    return None
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+        baseline = best_time(())
+        shared = best_time((f"-XX:SharedArchiveFile={archive}",)) if baseline is not None else None
+    finally:
+        discard_path(probe_root)
+    if baseline is None or shared is None:
+        return None
+    return round((baseline - shared) * 1000)
+
+def jvm_launch_profile(jar, stage, cds=True, env=None):
+    """Pick the launch flags and AppCDS archive for one jar and stage
+
+    Returns (flags, archive, dump_path): flags are the stage's tuning flags, archive
+    is the jar's AppCDS archive and dump_path, set while that archive does not exist
+    yet, the temporary file this launch dumps it into. Both are None when CDS is
+    off or the runtime cannot use it.
+    """
+    major, runtime_key = java_runtime(env)
+    flags = list(JVM_STAGE_FLAGS.get(stage, ())) if major >= JVM_STAGE_FLAGS_MIN_JAVA else []
+    if not cds or major < CDS_MIN_JAVA or not runtime_key:
+        return flags, None, None
+    archive = cds_archive_path(jar, stage, runtime_key)
+    if os.path.exists(archive):
+        return flags, archive, None
+    if load_cds_index().get(os.path.basename(archive), {}).get("failed"):
+        return flags, None, None
+    os.makedirs(CDS_DIR, exist_ok=True)
+    dump_path = f"{archive}.{os.getpid()}.{threading.get_ident()}.part"
+    return flags, archive, dump_path
+
+def java_heap_from_options(options):
+    """Return the -Xmx in bytes from a JVM options string (the last one wins), or None"""
+    units = {"": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+    matches = re.findall(r'-Xmx(\d+)([kmgt]?)(?!\S)', options or "", re.IGNORECASE)
+    if not matches:
+        return None
+    amount, unit = matches[-1]
+    return int(amount) * units[unit.lower()]
+
+class Job:
+    """One patching run with explicit paths and options
+
+    A job never changes the current directory, the process environment or exits
+    the interpreter, so a long-lived worker can run any number of them. Every
+    intermediate file lives in work_dir, run() returns the path of the patched APK
+    or raises a PatchError subclass, and each stage's return value is kept in
+    results under the stage name.
+    """
+    def __init__(self, apks_file, work_dir=None, output_dir=None, so_path=None, tools_dir=None,
+                 workspace="auto", minimal_decode=False, abis=None, device_abis=None,
+                 split_store=False, overlay=False, verify=True, estimates=None, logger=None, termux=None, cds=True):
+        self.apks_file = os.path.abspath(apks_file)
+        self.name = os.path.basename(apks_file).rsplit('.', 1)[0]
+        input_dir = os.path.dirname(self.apks_file)
+        self.termux = is_termux() if termux is None else termux
+        self.work_dir = os.path.abspath(work_dir) if work_dir else input_dir
+        self.output_dir = os.path.abspath(output_dir) if output_dir else input_dir
+        self.tools_dir = os.path.abspath(tools_dir) if tools_dir else input_dir
+        self.so_path = so_path
+        self.workspace = workspace
+        self.minimal_decode = minimal_decode
+        self.abis = abis
+        self.device_abis = device_abis
+        self.split_store = split_store
+        self.overlay = overlay
+        self.verify = verify
+        self.estimates = estimates
+        self.cds = cds
+        self.logger = logger
+        self.env = dict(os.environ)
+        self.env.setdefault("_JAVA_OPTIONS", java_heap_option(self.apks_file))
+        self.java_heap = java_heap_from_options(self.env["_JAVA_OPTIONS"])
+        self.apkeditor_jar = os.path.join(self.tools_dir, APKEDITOR_JAR)
+        self.signer_jar = os.path.join(self.tools_dir, SIGNER_JAR)
+        self.pairip_lib = None
+        self.created_firebase_lib = False
+        self.workspace_label = None
+        self.decompile_dir = None
+        self.scratch_dir = None
+        self.overlay_root = None
+        self.overlay_kind = None
+        self.pristine_lock = None
+        self.results = {}
+        self.stats = {}
+        self.child_usage = {}
+        self.stage_times = {}
+        self.jvm_launches = {}
+        self.cds_probes = []
+
+    def path(self, name):
+        """Return the path of an intermediate file in the job's work directory"""
+        return os.path.join(self.work_dir, name)
+
+    def java(self, jar, arguments, spinner_message, stage=None, replay=None):
+        """Run one of the bundled jars inside the work directory with the stage's launch profile
+
+        The first launch of a jar for a stage dumps an AppCDS archive at exit; later
+        launches map it instead of loading and verifying the jar's classes again.
+        replay(output_dir) rebuilds the arguments into a throwaway directory so
+        measure_cds_probes() can time the new archive after the stages finish.
+        """
+        flags, archive, dump_path = jvm_launch_profile(jar, stage, self.cds, self.env)
+        cds_flags = []
+        if dump_path:
+            cds_flags = [f"-XX:ArchiveClassesAtExit={dump_path}"]
+        elif archive:
+            cds_flags = [f"-XX:SharedArchiveFile={archive}"]
+        options = "".join(f'"{flag}" ' for flag in flags + cds_flags)
+        try:
+            output = run_with_spinner(f'java {options}-jar "{jar}" {arguments}', verbose=False,
+                                      spinner_message=spinner_message, cwd=self.work_dir, env=self.env,
+                                      usage=self.child_usage)
+        except CommandError as e:
+            if dump_path:
+                discard_path(dump_path)
+            if e.stage is None:
+                e.stage = stage
+            raise
+        launch = {"flags": flags, "cds": "off", "startup_saving_ms": None}
+        if archive and not dump_path:
+            launch.update(cds="used", startup_saving_ms=load_cds_index().get(os.path.basename(archive), {}).get("saving_ms"))
+        elif dump_path and os.path.exists(dump_path):
+            os.replace(dump_path, archive)
+            update_cds_index(os.path.basename(archive), {"saving_ms": None, "created": time.time()})
+            launch.update(cds="created")
+            if stage and replay:
+                self.cds_probes.append((stage, jar, flags, archive, replay))
+        elif dump_path:
+            update_cds_index(os.path.basename(archive), {"failed": True, "created": time.time()})
+            log.warning(f"This JVM could not dump an AppCDS archive for {os.path.basename(jar)}, not retrying")
+        if stage:
+            self.jvm_launches[stage] = launch
+            saving = launch["startup_saving_ms"]
+            log.info(f"JVM {stage}: {' '.join(flags) or 'default flags'}; AppCDS {launch['cds']}"
+                     + (f", startup saving ~{saving} ms" if saving is not None else ""))
+        return output
+
+    def measure_cds_probes(self):
+        """Time the AppCDS archives this job created by replaying their stages' commands
+
+        Runs outside the stage timings, once per new archive, while the stages'
+        inputs are still in the work directory.
+        """
+        probes, self.cds_probes = self.cds_probes, []
+        for stage, jar, flags, archive, replay in probes:
+            saving = measure_cds_saving(jar, flags, archive, replay, cwd=self.work_dir, env=self.env)
+            update_cds_index(os.path.basename(archive), {"saving_ms": saving, "created": time.time()})
+            self.jvm_launches[stage]["startup_saving_ms"] = saving
+            if saving is None:
+                log.warning(f"Could not time the new AppCDS archive for {stage}")
+            else:
+                log.info(f"AppCDS {stage}: startup saving ~{saving} ms on a replay of the stage")
+
+    def find_pairip_lib(self):
+        """Locate libpairipcorex.so next to so_path, the tools, the input or this script"""
+        for directory in (self.so_path, self.tools_dir, os.path.dirname(self.apks_file), SCRIPT_DIR):
+            if directory and os.path.exists(os.path.join(directory, PAIRIP_LIB)):
+                return os.path.join(directory, PAIRIP_LIB)
+        raise ToolError(f"Library not found: {PAIRIP_LIB}", stage="setup")
+
+    def run(self):
+        """Run the pipeline with this job's logger active; returns the patched APK path"""
+        with using_logger(self.logger):
+            try:
+                return process_apk(self)
+            finally:
+                log.close_progress("main")
+                log.flush()
+
+    def cleanup(self):
+        """Discard the job's intermediate files; returns how many were removed"""
+        with using_logger(self.logger):
+            cleanup_count = 0
+            if self.overlay_root and close_overlay_view(self.overlay_root, self.overlay_kind):
+                self.overlay_root = None
+                cleanup_count += 1
+            if not self.overlay_root:
+                release_pristine_tree(self.pristine_lock)
+                self.pristine_lock = None
+            if self.scratch_dir and discard_path(self.scratch_dir):
+                self.scratch_dir = None
+                cleanup_count += 1
+                log.success("Deleted job scratch directory")
+            leftovers = JOB_LEFTOVERS + ((FIREBASE_LIB,) if self.created_firebase_lib else ())
+            for name in leftovers:
+                try:
+                    if discard_path(self.path(name)):
+                        cleanup_count += 1
+                        if name == DECOMPILE_DIR_NAME:
+                            log.success(f"Deleted temporary directory: {name}")
+                        else:
+                            log.info(f"Deleted temporary file: {name}")
+                except OSError as e:
+                    log.warning(f"Failed to delete {name}: {e}")
+            cleanup_count += discard_temp_leftovers(self.work_dir)
+            # Empty the trash now, not at interpreter exit: a worker may live for days
+            reap_graveyards_async()
+            log.flush()
+            return cleanup_count
+
+def process_apk(job):
+    """Run every stage of a Job; returns the patched APK path or raises PatchError"""
+    for jar in (job.apkeditor_jar, job.signer_jar):
+        if not os.path.exists(jar):
+            raise ToolError(f"Required JAR file '{os.path.basename(jar)}' not found", stage="setup")
+    job.pairip_lib = job.find_pairip_lib()
+    apks_input = job.apks_file
+    self_peak_before = self_peak_rss_kb()
+
+    if job.termux:
+        log.header("Preparing Termux environment...")
+        job.work_dir = setup_termux_workdir()
+        stop_spinner = start_spinner("Setting up Termux")
+
+        try:
+            cache_index = load_tool_cache_index()
+            staged = {
+                "apks": stage_to_termux(job.apks_file, job.work_dir),
+                "apkeditor": stage_cached_tool(job.apkeditor_jar, job.work_dir, cache_index),
+                # Only libpairipcorex.so is staged, libFirebaseCppApp.so is generated later
+                PAIRIP_LIB: stage_cached_tool(job.pairip_lib, job.work_dir, cache_index),
+                "signer": stage_cached_tool(job.signer_jar, job.work_dir, cache_index)
+            }
+            try:
+                save_tool_cache_index(cache_index)
+            except OSError as e:
+                log.warning(f"Could not update tool cache index: {e}")
+        except OSError as e:
+            stop_spinner()
+            raise ToolError(f"Error preparing Termux environment: {e}", stage="setup") from e
+        stop_spinner()
+        for path, method in staged.values():
+            log.success(f"Staged {os.path.basename(path)} ({method})")
+        apks_input = staged["apks"][0]
+        job.apkeditor_jar = staged["apkeditor"][0]
+        job.signer_jar = staged["signer"][0]
+        job.pairip_lib = staged[PAIRIP_LIB][0]
+    try:
+        os.makedirs(job.work_dir, exist_ok=True)
+        if job.overlay:
+            # The decompile tree is a view over the pristine cache, opened in step 6
+            job.workspace_label, workspace_root = "overlay", VIEWS_DIR
+            decompile_dir = None
+        else:
+            job.workspace_label, workspace_root = select_workspace(job.work_dir, job.workspace,
+                                                                    os.path.getsize(apks_input), job.java_heap)
+            job.scratch_dir, decompile_dir = create_job_scratch(job.workspace_label, workspace_root)
+            job.decompile_dir = decompile_dir
+    except OSError as e:
+        raise StageError(f"Could not prepare the workspace: {e}", stage="setup") from e
+    if not job.overlay:
+        log.info(f"Decompile workspace: {job.workspace_label} ({decompile_dir})")
     
-    # Step 3: Remove old files
+    stages = StageTracker(job.estimates)
+    job.stage_times = stages.times
+    job.stats = job_stats = {"input_bytes": os.path.getsize(apks_input)}
+    base_apk = job.path("base.apk")
+    merged_apk = job.path("merged_app.apk")
+    out_apk = job.path("out.apk")
+    firebase_lib = job.path(FIREBASE_LIB)
+    
+    # Step 1: Extract base.apk
     start_time = time.time()
-    log.header("Step 3/11: Cleaning previous files")
-    cleaned = 0
-    if os.path.exists("merged_app.apk"):
-        os.remove("merged_app.apk")
-        cleaned += 1
-    if os.path.exists(decompile_dir):
-        delete_dir_crossplatform(decompile_dir)
-        cleaned += 1
-    log.success(f"Removed {cleaned} old files/directories in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    log.header("Step 1/12: Extracting base.apk")
+    merge_input = apks_input
+    if job.split_store:
+        splits_dir = job.path("splits")
+        try:
+            staged, hits, extracted = stage_splits_from_store(merge_input, splits_dir)
+            log.info(f"Split store: {hits}/{staged} splits reused, {extracted / (1024 * 1024):.2f} MB extracted")
+            link_or_copy(os.path.join(splits_dir, "base.apk"), base_apk)
+            merge_input = splits_dir
+            success = True
+        except (OSError, zipfile.BadZipFile, ValueError) as e:
+            log.warning(f"Split store unavailable, extracting directly: {e}")
+            discard_path(splits_dir)
+            success = extract_file(merge_input, "base.apk", job.work_dir)
+    else:
+        success = extract_file(merge_input, "base.apk", job.work_dir)
+    if not success:
+        raise InputError("Failed to extract base.apk", stage="extract")
+    log.success(f"Extracted base.apk in {time.time() - start_time:.1f} seconds")
+    job.results["extract"] = base_apk
+    stages.finish("extract", start_time)
     
     # Step 2: Create libFirebaseCppApp.so
     start_time = time.time()
-    log.header("Step 2/11: Creating libFirebaseCppApp.so")
-    if not os.path.exists("libFirebaseCppApp.so"):
-        if os.path.exists("base.apk"):
-            shutil.copy("base.apk", "libFirebaseCppApp.so")
-            log.success("Created libFirebaseCppApp.so from base.apk")
-        else:
-            log.error("base.apk not found to create libFirebaseCppApp.so")
-            sys.exit(1)
+    log.header("Step 2/12: Creating libFirebaseCppApp.so")
+    if not os.path.exists(firebase_lib):
+        if not os.path.exists(base_apk):
+            raise StageError("base.apk not found to create libFirebaseCppApp.so", stage="firebase_lib")
+        try:
+            method = link_or_copy(base_apk, firebase_lib)
+        except OSError as e:
+            raise StageError(f"Could not create libFirebaseCppApp.so: {e}", stage="firebase_lib") from e
+        job.created_firebase_lib = True
+        log.success(f"Created libFirebaseCppApp.so from base.apk ({method})")
     else:
         log.success("libFirebaseCppApp.so already exists")
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["firebase_lib"] = firebase_lib
+    stages.finish("firebase_lib", start_time)
     
     # Step 3: Remove old files
     start_time = time.time()
-    log.header("Step 3/11: Cleaning previous files")
+    log.header("Step 3/12: Cleaning previous files")
     cleaned = 0
-    if os.path.exists("merged_app.apk"):
-        os.remove("merged_app.apk")
+    if os.path.exists(merged_apk):
+        try:
+            os.remove(merged_apk)
+        except OSError as e:
+            raise StageError(f"Could not remove the old merged APK: {e}", stage="clean") from e
         cleaned += 1
-    if os.path.exists(decompile_dir):
-        delete_dir_crossplatform(decompile_dir)
+    if decompile_dir and discard_path(decompile_dir):
         cleaned += 1
     log.success(f"Removed {cleaned} old files/directories in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["clean"] = cleaned
+    stages.finish("clean", start_time)
     
     # Step 4: Merge APKS to APK
     start_time = time.time()
-    log.header("Step 4/11: Merging APKS to APK")
-    run_with_spinner(
-        f'java -jar APKEditor-1.4.3.jar m -i "{termux_files.get("apks", apks_file)}" -o merged_app.apk -extractNativeLibs true',
-        verbose=False,
-        spinner_message="Merging APKS"
-    )
-    if os.path.exists("merged_app.apk"):
-        merged_size = os.path.getsize("merged_app.apk") / (1024 * 1024)
-        log.success(f"Successfully merged to APK (Size: {merged_size:.2f} MB) in {time.time() - start_time:.1f} seconds")
-    else:
-        log.error("Failed to merge APKS to APK")
-        sys.exit(1)
-    progress.update(1)
+    log.header("Step 4/12: Merging APKS to APK")
+    job.java(job.apkeditor_jar, f'm -i "{merge_input}" -o "{merged_apk}" -extractNativeLibs true', "Merging APKS", "merge",
+             replay=lambda out: f'm -i "{merge_input}" -o "{os.path.join(out, "merged.apk")}" -extractNativeLibs true')
+    if not os.path.exists(merged_apk):
+        raise StageError("Failed to merge APKS to APK", stage="merge")
+    merged_size = os.path.getsize(merged_apk) / (1024 * 1024)
+    log.success(f"Successfully merged to APK (Size: {merged_size:.2f} MB) in {time.time() - start_time:.1f} seconds")
+    
+    try:
+        with zipfile.ZipFile(merged_apk, 'r') as zip_ref:
+            job_stats["dex_count"] = sum(1 for name in zip_ref.namelist() if DEX_NAME_PATTERN.match(name))
+    except (OSError, zipfile.BadZipFile):
+        pass
+    
+    keep_abis = None
+    if job.abis or job.device_abis:
+        available_abis = apk_abis(merged_apk)
+        keep_abis = resolve_target_abis(job.abis, job.device_abis, available_abis)
+        if not available_abis:
+            log.info("APK has no native libraries, ABI filter not needed")
+        elif not keep_abis:
+            raise InputError(f"None of the requested ABIs are in the APK (available: {', '.join(sorted(available_abis))})",
+                             stage="merge")
+        elif set(keep_abis) != available_abis:
+            try:
+                dropped, dropped_bytes = filter_apk_abis(merged_apk, keep_abis)
+            except (OSError, zipfile.BadZipFile) as e:
+                raise StageError(f"Could not filter ABIs: {e}", stage="merge") from e
+            log.success(f"Kept ABI(s) {', '.join(keep_abis)}; dropped {dropped} native files "
+                        f"({dropped_bytes / (1024 * 1024):.2f} MB)")
+    try:
+        pairip_abis = pairip_lib_abis(merged_apk)
+    except (OSError, zipfile.BadZipFile) as e:
+        log.warning(f"Could not verify architectures: {e}")
+        pairip_abis = []
+    job.results["merge"] = {"apk": merged_apk, "abis": keep_abis, "pairip_abis": pairip_abis}
+    stages.finish("merge", start_time)
     
     # Step 5: Prepare decompilation
     start_time = time.time()
-    log.header("Step 5/11: Preparing decompilation")
-    if os.path.exists(decompile_dir):
+    log.header("Step 5/12: Preparing decompilation")
+    if decompile_dir and os.path.exists(decompile_dir):
         log.info("Removing existing decompiled directory")
-        shutil.rmtree(decompile_dir, ignore_errors=True)
+        discard_path(decompile_dir)
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    stages.finish("prepare", start_time)
     
     # Step 6: Decompile the merged APK
     start_time = time.time()
-    log.header("Step 6/11: Decompiling merged APK")
-    run_with_spinner(
-        "java -jar APKEditor-1.4.3.jar d -i merged_app.apk",
-        verbose=False,
-        spinner_message="Decompiling APK"
-    )
-    if os.path.exists(decompile_dir):
-        log.success(f"Decompilation completed in {time.time() - start_time:.1f} seconds")
+    log.header("Step 6/12: Decompiling merged APK")
+    decode_input = merged_apk
+    target_dex = {}
+    if job.minimal_decode:
+        try:
+            target_dex = find_pairip_dex(merged_apk)
+        except (zipfile.BadZipFile, ValueError, struct.error) as e:
+            log.warning(f"Could not scan dex files: {e}")
+        if target_dex:
+            decode_input = job.path("slim_app.apk")
+            try:
+                dropped = create_slim_apk(merged_apk, decode_input, target_dex)
+            except (OSError, zipfile.BadZipFile) as e:
+                raise StageError(f"Could not create the slim APK: {e}", stage="decompile") from e
+            log.info(f"Minimal decode: {', '.join(sorted(target_dex))} ({dropped} entries left packed)")
+        else:
+            log.warning("No com/pairip classes found in any dex, falling back to a full decode")
+
+    def decompile(target_dir):
+        job.java(job.apkeditor_jar, f'd -i "{decode_input}" -o "{target_dir}"', "Decompiling APK", "decompile",
+                 replay=lambda out: f'd -i "{decode_input}" -o "{os.path.join(out, "decompiled")}"')
+        if not os.path.exists(target_dir):
+            raise StageError("Decompilation failed", stage="decompile")
+
+    if job.overlay:
+        key = pristine_tree_key(file_sha256(job.apks_file), keep_abis, target_dex, file_sha256(job.apkeditor_jar))
+        try:
+            pristine_tree, hit, job.pristine_lock = ensure_pristine_tree(key, decompile)
+            decompile_dir, job.overlay_root, job.overlay_kind = open_overlay_view(pristine_tree)
+        except OSError as e:
+            raise StageError(f"Could not prepare overlay workspace: {e}", stage="decompile") from e
+        job.decompile_dir = decompile_dir
+        log.success(f"{'Reused' if hit else 'Cached'} pristine tree {key[:12]} ({job.overlay_kind} view) "
+                    f"in {time.time() - start_time:.1f} seconds")
     else:
-        log.error("Decompilation failed")
-        sys.exit(1)
-    progress.update(1)
+        decompile(decompile_dir)
+        log.success(f"Decompilation completed in {time.time() - start_time:.1f} seconds")
+    job.results["decompile"] = {"dir": decompile_dir, "dex": sorted(target_dex)}
+    stages.finish("decompile", start_time)
     
-    # Step 7: Modify AndroidManifest.xml
+    # Step 7: Rewrite AndroidManifest.xml and file_paths.xml
     start_time = time.time()
-    log.header("Step 7/11: Modifying AndroidManifest.xml")
-    manifest_path = os.path.join(decompile_dir, "AndroidManifest.xml")
-    entries_removed = 0
-    permissions_removed = 0
-    if os.path.exists(manifest_path):
-        with open(manifest_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Remove license check entries
-        pattern1 = r'<activity[^>]+com\.pairip\.licensecheck\.LicenseActivity[^<]+/>'
-        pattern2 = r'<provider[^>]+com\.pairip\.licensecheck\.LicenseContentProvider[^<]+/>'
-        for pattern in [pattern1, pattern2]:
-            matches = re.findall(pattern, content, flags=re.DOTALL)
-            entries_removed += len(matches)
-            content = re.sub(pattern, '', content, flags=re.DOTALL)
-        
-        # Remove CHECK_LICENSE permission
-        permission_pattern = r'<uses-permission[^>]+android:name="com\.android\.vending\.CHECK_LICENSE"[^<]*/>'
-        matches = re.findall(permission_pattern, content, flags=re.DOTALL)
-        permissions_removed = len(matches)
-        content = re.sub(permission_pattern, '', content, flags=re.DOTALL)
-        
-        if entries_removed > 0 or permissions_removed > 0:
-            with open(manifest_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            if entries_removed > 0:
-                log.success(f"Removed {entries_removed} license check entries")
-            if permissions_removed > 0:
-                log.success(f"Removed CHECK_LICENSE permission")
-        else:
-            log.warning("No license check entries or CHECK_LICENSE permission found")
-    else:
-        log.warning("AndroidManifest.xml not found")
+    log.header("Step 7/12: Rewriting manifest and resources")
+    resources_rewritten = rewrite_resources(decompile_dir)
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["resources"] = resources_rewritten
+    stages.finish("resources", start_time)
     
     # Step 8: Patch files
     start_time = time.time()
-    log.header("Step 8/11: Patching decompiled files")
-    patch_result = patch_files()
-    if not patch_result:
+    log.header("Step 8/12: Patching decompiled files")
+    try:
+        patch_result = patch_files(decompile_dir, [job.pairip_lib, firebase_lib], pairip_abis)
+    except OSError as e:
+        raise StageError(f"Could not patch the decompiled files: {e}", stage="patch") from e
+    if not (patch_result["patched"] or resources_rewritten):
         log.warning("No files were patched")
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["patch"] = patch_result
+    stages.finish("patch", start_time)
     
     # Step 9: Preprocess XML files in parallel
     start_time = time.time()
-    log.header("Step 9/11: Preprocessing XML files in parallel")
+    log.header("Step 9/12: Preprocessing XML files in parallel")
     xml_files = []
+    resource_files = 0
     for root, _, files in os.walk(os.path.join(decompile_dir, 'resources')):
+        resource_files += len(files)
         for file in files:
             if file.endswith('.xml'):
                 xml_files.append(os.path.join(root, file))
+    job_stats["resource_files"] = resource_files
+    job_stats["smali_files"] = count_files(os.path.join(decompile_dir, 'smali'))
     
     if xml_files:
         with Pool() as pool:
@@ -814,35 +2970,39 @@ def process_apk(apks_file, so_path=None):
     else:
         log.info("No XML files found for preprocessing")
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["xml_preprocess"] = len(xml_files)
+    stages.finish("xml_preprocess", start_time)
     
     # Step 10: Build APK
     start_time = time.time()
-    log.header("Step 10/11: Building modified APK")
-    if os.path.exists("out.apk"):
-        os.remove("out.apk")
+    log.header("Step 10/12: Building modified APK")
+    if os.path.exists(out_apk):
+        try:
+            os.remove(out_apk)
+        except OSError as e:
+            raise StageError(f"Could not remove the old build: {e}", stage="build") from e
     
-    run_with_spinner(
-        f'java -jar APKEditor-1.4.3.jar b -i "{decompile_dir}" -o out.apk',
-        verbose=False,
-        spinner_message="Building APK"
-    )
-    if os.path.exists("out.apk"):
-        out_size = os.path.getsize("out.apk") / (1024 * 1024)
-        log.success(f"Build completed in {time.time() - start_time:.1f} seconds (Size: {out_size:.2f} MB)")
-    else:
-        log.error("Failed to build modified APK")
-        sys.exit(1)
-    progress.update(1)
+    build_output = job.path("out_slim.apk") if decode_input != merged_apk else out_apk
+    job.java(job.apkeditor_jar, f'b -i "{decompile_dir}" -o "{build_output}"', "Building APK", "build",
+             replay=lambda out: f'b -i "{decompile_dir}" -o "{os.path.join(out, "out.apk")}"')
+    if build_output != out_apk and os.path.exists(build_output):
+        try:
+            reused = splice_minimal_build(merged_apk, build_output, out_apk)
+        except (OSError, zipfile.BadZipFile) as e:
+            raise StageError(f"Could not splice the minimal build: {e}", stage="build") from e
+        log.info(f"Reused {reused} untouched entries from the merged APK")
+    if not os.path.exists(out_apk):
+        raise StageError("Failed to build modified APK", stage="build")
+    out_size = os.path.getsize(out_apk) / (1024 * 1024)
+    log.success(f"Build completed in {time.time() - start_time:.1f} seconds (Size: {out_size:.2f} MB)")
+    job.results["build"] = out_apk
+    stages.finish("build", start_time)
     
     # Step 11: Sign the APK
     start_time = time.time()
-    log.header("Step 11/11: Signing the APK")
-    run_with_spinner(
-        "java -jar uber-apk-signer.jar -a out.apk --overwrite",
-        verbose=False,
-        spinner_message="Signing APK"
-    )
+    log.header("Step 11/12: Signing the APK")
+    job.java(job.signer_jar, f'-a "{out_apk}" --overwrite', "Signing APK", "sign",
+             replay=lambda out: f'-a "{out_apk}" -o "{out}" --allowResign')
     
     signed_apk_patterns = [
         "out-aligned-signed.apk",
@@ -853,219 +3013,392 @@ def process_apk(apks_file, so_path=None):
     
     signed_apk = None
     for pattern in signed_apk_patterns:
-        if os.path.exists(pattern):
-            signed_apk = pattern
+        if os.path.exists(job.path(pattern)):
+            signed_apk = job.path(pattern)
             break
     
-    output_name = f"{base_name}-patched.apk"
+    if not signed_apk and is_v2_signed(out_apk):
+        # --overwrite signs out.apk in place
+        signed_apk = out_apk
     
+    # The APK stays in the work directory until it has been verified
     if signed_apk:
-        shutil.move(signed_apk, output_name)
-        sign_size = os.path.getsize(output_name) / (1024 * 1024)
+        staged_apk = signed_apk
+        sign_size = os.path.getsize(staged_apk) / (1024 * 1024)
         log.success(f"APK signed successfully (Size: {sign_size:.2f} MB)")
+    elif os.path.exists(out_apk):
+        staged_apk = out_apk
+        log.warning("Signing failed. Using unsigned APK")
     else:
-        if os.path.exists("out.apk"):
-            shutil.move("out.apk", output_name)
-            log.warning(f"Signing failed. Using unsigned APK: {output_name}")
-        else:
-            log.error("Error: No output APK found")
-            sys.exit(1)
+        raise StageError("Error: No output APK found", stage="sign")
     log.success(f"Completed in {time.time() - start_time:.1f} seconds")
-    progress.update(1)
+    job.results["sign"] = {"apk": staged_apk, "signed": bool(signed_apk)}
+    stages.finish("sign", start_time)
     
-    # Move result back if Termux
-    if is_termux():
+    # Step 12: Verify the output
+    start_time = time.time()
+    log.header("Step 12/12: Verifying the output")
+    output_name = os.path.join(job.output_dir, f"{job.name}-patched.apk")
+    if job.verify:
         try:
-            final_output = move_result_back(os.path.join(work_dir, output_name), original_dir)
-            log.success(f"Final APK moved to: {final_output}")
-            output_name = final_output
-        except Exception as e:
-            log.error(f"Failed to move final APK: {e}")
-            sys.exit(1)
+            report = verify_output_apk(staged_apk, patch_result["patched"], patch_result["abis"],
+                                       [job.pairip_lib, firebase_lib])
+        except (OSError, zipfile.BadZipFile, ValueError, struct.error) as e:
+            report = {"apk": staged_apk, "checks": 0, "failures": [f"Could not verify the APK: {e}"], "seconds": 0.0}
+        job.results["verify"] = report
+        if report["failures"]:
+            for failure in report["failures"]:
+                log.error(failure)
+            # Keep the rejected APK for inspection without touching a previous good output
+            rejected = os.path.join(job.output_dir, f"{job.name}-unverified.apk")
+            try:
+                publish_output(staged_apk, rejected)
+                log.warning(f"Kept the rejected APK as {os.path.basename(rejected)}")
+            except OSError as e:
+                log.warning(f"Could not keep the rejected APK: {e}")
+            if not report["checks"]:
+                raise StageError(report["failures"][0], stage="verify")
+            raise StageError(f"Verification failed: {len(report['failures'])} of {report['checks']} checks",
+                             stage="verify")
+        log.success(f"All {report['checks']} checks passed in {report['seconds']:.2f} seconds")
+    else:
+        log.info("Verification skipped")
+    stages.finish("verify", start_time)
+    
+    # Time new AppCDS archives against the stages' real commands, outside the stage timings
+    if job.cds_probes:
+        log.subheader("Timing new AppCDS archives...")
+        job.measure_cds_probes()
+    
+    # Only a verified (or explicitly unverified) APK replaces <name>-patched.apk
+    try:
+        publish_output(staged_apk, output_name)
+    except OSError as e:
+        raise StageError(f"Failed to publish final APK: {e}", stage="verify") from e
+    job.results["sign"]["apk"] = output_name
+    discard_path(os.path.join(job.output_dir, f"{job.name}-unverified.apk"))
+    log.success(f"Final APK written to: {output_name}")
     
     # Clean up temporary files
     start_time = time.time()
     log.subheader("Cleaning up temporary files...")
-    cleanup_files = 0
-    for tmp_file in glob.glob("*.tmp*"):
-        try:
-            os.remove(tmp_file)
+    cleanup_files = discard_temp_leftovers(job.work_dir)
+    if job.overlay_root:
+        if close_overlay_view(job.overlay_root, job.overlay_kind):
+            job.overlay_root = None
+            release_pristine_tree(job.pristine_lock)
+            job.pristine_lock = None
             cleanup_files += 1
-        except Exception:
-            pass
-    
-    for tmp_dir in glob.glob("tmp-*"):
-        if os.path.isdir(tmp_dir):
-            try:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-                cleanup_files += 1
-            except Exception:
-                pass
+    elif job.scratch_dir and discard_path(job.scratch_dir):
+        job.scratch_dir = None
+        cleanup_files += 1
     
     log.success(f"Removed {cleanup_files} temporary files/directories in {time.time() - start_time:.1f} seconds")
+    log.info(f"Workspace used: {job.workspace_label} ({workspace_root})")
     
-    log.close_progress("main")
+    stages.close()
+    job_stats["peak_rss_kb"] = job_peak_rss_kb(self_peak_before, job.child_usage.get("peak_rss_kb"))
+    try:
+        record_job_timings(job.apks_file, job_stats, stages.times, job.jvm_launches)
+    except sqlite3.Error as e:
+        log.warning(f"Could not record stage timings: {e}")
     return output_name
 
+# Bump whenever a patch rule changes so memoized outputs are rebuilt
+RULESET_VERSION = "1"
+MEMO_PATH = os.path.join(CACHE_DIR, "memo.json")
+
+def load_memo():
+    """Load the output memo (input hashes and memoized outputs)"""
+    try:
+        with open(MEMO_PATH, 'r', encoding='utf-8') as f:
+            memo = json.load(f)
+    except (OSError, ValueError):
+        memo = {}
+    memo.setdefault("hashes", {})
+    memo.setdefault("outputs", {})
+    return memo
+
+def save_memo(memo):
+    """Atomically write the output memo"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = MEMO_PATH + f".{os.getpid()}.part"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(memo, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, MEMO_PATH)
+
+def file_stamp(path):
+    """Return a cheap change detector for a file: [size, mtime_ns, inode]"""
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+def memo_file_hash(path, memo):
+    """Return the SHA-256 of a file, reusing the memoized value while its stamp is unchanged"""
+    abs_path = os.path.abspath(path)
+    stamp = file_stamp(abs_path)
+    entry = memo["hashes"].get(abs_path)
+    if entry and entry["stamp"] == stamp:
+        return entry["sha256"]
+    digest = file_sha256(abs_path)
+    memo["hashes"][abs_path] = {"stamp": stamp, "sha256": digest}
+    return digest
+
+def output_memo_key(apks_file, memo, abis=None):
+    """Build the memo key (input hash, rule-set version, signer key, ABI filter) for an input"""
+    signer_jar = os.path.join(os.path.dirname(os.path.abspath(apks_file)), "uber-apk-signer.jar")
+    # uber-apk-signer signs with its bundled debug key, so the jar identifies the key
+    signer_id = memo_file_hash(signer_jar, memo) if os.path.exists(signer_jar) else "missing"
+    abi_id = ",".join(abis) if abis else "all"
+    return f"{memo_file_hash(apks_file, memo)}:{RULESET_VERSION}:{signer_id}:{abi_id}"
+
+def lookup_memoized_output(key, memo, verified=False):
+    """Return the memoized output path for key if it still exists unmodified
+
+    With verified set, outputs recorded without passing the output checks are
+    not reused.
+    """
+    entry = memo["outputs"].get(key)
+    if not entry or (verified and not entry.get("verified")):
+        return None
+    try:
+        if file_stamp(entry["path"]) == entry["stamp"]:
+            return entry["path"]
+    except OSError:
+        pass
+    del memo["outputs"][key]
+    return None
+
+def record_memoized_output(key, output_path, memo, verified=False):
+    """Remember the output produced for key and whether it passed the output checks"""
+    abs_path = os.path.abspath(output_path)
+    memo["outputs"][key] = {"path": abs_path, "stamp": file_stamp(abs_path), "verified": verified}
+
 def center_text(text, width):
     """Center text for display"""
     return text.center(width)
 
-def main():
-    """Main function"""
-    width = shutil.get_terminal_size().columns
-    border = "▓" * width
-
-    line1 = center_text("PairIP Protection Remover v1.3 (Termux Optimized)", width)
-    line2 = center_text("Cross-platform Edition", width)
-    footer = center_text("© void.eth | Modified for Termux by Zalgo", width)
-
-    print(f"\n{Style.BRIGHT}{Fore.CYAN}{border}{Style.RESET_ALL}")
-    print(f"{Style.BRIGHT}{Fore.CYAN}{line1}{Style.RESET_ALL}")
-    print(f"{Style.BRIGHT}{Fore.CYAN}{line2}{Style.RESET_ALL}")
-    print(f"{Style.BRIGHT}{Fore.CYAN}{border}{Style.RESET_ALL}")
-    print(f"{Style.BRIGHT}{Fore.CYAN}{footer}{Style.RESET_ALL}\n")
-    
-    apks_file = None
-    so_path = None
-    if len(sys.argv) == 3:
-        apks_file = sys.argv[1]
-        so_path = sys.argv[2]
-    elif len(sys.argv) == 2:
-        apks_file = sys.argv[1]
-    else:
-        apks_files = glob.glob("*.apks")
-        if not apks_files:
-            log.error("No .apks files found in the current directory")
-            sys.exit(1)
-        elif len(apks_files) > 1:
-            log.warning(f"Multiple .apks files found: {', '.join(apks_files)}")
-            log.info(f"Selecting the first one: {apks_files[0]}")
-        apks_file = apks_files[0]
-
+def run_job(apks_file, so_path, args, device_abis=None, estimates=None):
+    """Validate, process and clean up one input; returns False if the input could not be processed"""
+    log.job = os.path.basename(apks_file).rsplit('.', 1)[0]
     if not os.path.exists(apks_file):
         log.error(f"Input file '{apks_file}' not found")
-        sys.exit(1)
+        return False
     
     try:
-        with zipfile.ZipFile(apks_file, 'r') as zip_ref:
-            zip_ref.testzip()
+        check_zip_structure(apks_file)
         log.success(f"Input file '{apks_file}' is a valid ZIP archive")
-    except zipfile.BadZipFile:
+    except (OSError, zipfile.BadZipFile):
         log.error(f"Input file '{apks_file}' is not a valid .apks file")
-        sys.exit(1)
+        return False
     
     if not apks_file.endswith('.apks'):
         log.warning(f"Input file doesn't have .apks extension")
     
-    log.info("Checking Java installation...")
-    try:
-        java_version = run_command("java -version", verbose=False, exit_on_error=False)
-        if not java_version:
-            java_version = run_command("java -version 2>&1", verbose=False, exit_on_error=False)
-        log.success("Java detected")
-    except Exception:
-        log.error("Java not found. Please install Java Runtime Environment")
-        sys.exit(1)
+    if not args.force:
+        report = scan_input(apks_file)
+        if report["already_patched"]:
+            log.warning(f"Input file '{apks_file}' is already patched, nothing to do (use --force to reprocess)")
+            return True
     
-    work_dir = os.path.dirname(os.path.abspath(apks_file))
-    os.chdir(work_dir)
+    memo = load_memo()
+    memo_key = output_memo_key(apks_file, memo, args.abi or device_abis)
+    if not args.force:
+        memoized = lookup_memoized_output(memo_key, memo, verified=args.verify)
+        if memoized:
+            log.success(f"Input unchanged since last run, reusing: {memoized}")
+            return True
     
     log.info(f"Processing file: {os.path.basename(apks_file)}")
     start_time = time.time()
-    out_name = process_apk(apks_file, so_path)
+    job = Job(apks_file, so_path=so_path, workspace=args.workspace, minimal_decode=args.minimal_decode,
+              abis=args.abi, device_abis=device_abis, split_store=args.split_store,
+              overlay=args.overlay, verify=args.verify, estimates=estimates, cds=args.cds)
+    try:
+        out_name = job.run()
+    except PatchError as e:
+        log.error(str(e))
+        out_name = None
+    except Exception as e:
+        # A bug or an unexpected input fails this job, not the batch
+        log.error(f"Unexpected error while processing {os.path.basename(apks_file)}: {e}\n"
+                  f"{traceback.format_exc().rstrip()}")
+        out_name = None
+    except BaseException:
+        # Give back the job's scratch tree before KeyboardInterrupt/SystemExit reaches main()
+        job.cleanup()
+        raise
     total_time = time.time() - start_time
-    
-    log.header("Finalizing...")
-    leftovers = [
-        "base.apk", "merged_app.apk", "out.apk", 
-        "out-aligned-debugSigned.apk", "out-aligned-signed.apk", 
-        "out-debugSigned.apk", "out-signed.apk", "merged_app_decompile_xml"
-    ]
-    
-    cleanup_count = 0
-    for file in leftovers:
-        if os.path.exists(file):
-            try:
-                delete_dir_crossplatform(file)
-                cleanup_count += 1
-                if file == "merged_app_decompile_xml":
-                    log.success(f"Deleted temporary directory: {file}")
-                else:
-                    log.info(f"Deleted temporary file: {file}")
-            except Exception as e:
-                log.warning(f"Failed to delete {file}: {e}")
-    
-    # Clean up additional temporary files and directories
-    for tmp_file in glob.glob("*.tmp*"):
+    if out_name and not job.results["sign"]["signed"]:
+        log.warning("Not remembering an unsigned output; the next run will patch again")
+    elif out_name:
         try:
-            os.remove(tmp_file)
-            cleanup_count += 1
-            log.info(f"Deleted temporary file: {tmp_file}")
-        except Exception as e:
-            log.warning(f"Failed to remove {tmp_file}: {e}")
+            record_memoized_output(memo_key, out_name, memo, verified="verify" in job.results)
+            save_memo(memo)
+        except OSError as e:
+            log.warning(f"Could not update output memo: {e}")
     
-    for tmp_dir in glob.glob("tmp-*"):
-        if os.path.isdir(tmp_dir):
-            try:
-                shutil.rmtree(tmp_dir, ignore_errors=True)
-                cleanup_count += 1
-                log.info(f"Deleted temporary directory: {tmp_dir}")
-            except Exception as e:
-                log.warning(f"Failed to remove {tmp_dir}: {e}")
+    log.header("Finalizing...")
+    cleanup_count = job.cleanup()
     
     # Clean up Termux working directory (~/apk_work)
     termux_dir = os.path.expanduser("~/apk_work")
     termux_cleanup_count = 0
     if is_termux():
-        log.info(f"Starting cleanup of Termux working directory: {termux_dir}")
         if os.path.exists(termux_dir):
-            # First attempt: delete individual items
-            for item in os.listdir(termux_dir):
-                item_path = os.path.join(termux_dir, item)
-                try:
-                    if os.path.isfile(item_path):
-                        os.unlink(item_path)
-                        termux_cleanup_count += 1
-                    elif os.path.isdir(item_path):
-                        shutil.rmtree(item_path, ignore_errors=True)
-                        termux_cleanup_count += 1
-                    log.success(f"Deleted from Termux working directory: {item}")
-                except Exception as e:
-                    log.warning(f"Failed to delete {item_path} from Termux working directory: {e}")
-            if termux_cleanup_count > 0:
-                log.success(f"Cleared {termux_cleanup_count} items from Termux working directory")
-            # Second attempt: forcefully remove the directory
-            try:
-                shutil.rmtree(termux_dir, ignore_errors=True)
-                if not os.path.exists(termux_dir):
-                    log.success("Deleted Termux working directory: ~/apk_work")
-                else:
-                    log.warning("Termux working directory still exists after cleanup attempt")
-            except Exception as e:
-                log.warning(f"Failed to delete Termux working directory {termux_dir}: {e}")
+            if discard_path(termux_dir):
+                termux_cleanup_count += 1
+                log.success("Deleted Termux working directory: ~/apk_work")
+            else:
+                log.warning("Termux working directory still exists after cleanup attempt")
         else:
             log.info("Termux working directory does not exist, no cleanup needed")
     else:
         log.info("Not running in Termux, skipping ~/apk_work cleanup")
     
+    # Empty the trash in a detached process so the job finishes now
+    reap_graveyards_async()
+    
     if cleanup_count > 0 or termux_cleanup_count > 0:
         log.success(f"Removed {cleanup_count + termux_cleanup_count} temporary files/directories")
     else:
         log.info("No temporary files or directories to remove")
     
-    if out_name:
+    if out_name and log.headless:
+        output_path = os.path.abspath(out_name)
+        output_size = os.path.getsize(output_path) / (1024 * 1024)
+        log.success(f"Final APK: {output_path} ({output_size:.2f} MB) in {total_time:.1f} seconds")
+    elif out_name:
         output_path = os.path.abspath(out_name)
         output_size = os.path.getsize(output_path) / (1024 * 1024)
         
         print(f"\n{Style.BRIGHT}{Fore.GREEN}╔══════════════════════════════════════════════╗{Style.RESET_ALL}")
         print(f"{Style.BRIGHT}{Fore.GREEN}║              PROCESS COMPLETE                ║{Style.RESET_ALL}")
         print(f"{Style.BRIGHT}{Fore.GREEN}╚══════════════════════════════════════════════╝{Style.RESET_ALL}")
-        print(f"\n{Fore.GREEN}✓ Final APK: {Style.BRIGHT}{out_name}{Style.RESET_ALL}")
+        print(f"\n{Fore.GREEN}✓ Final APK: {Style.BRIGHT}{os.path.basename(out_name)}{Style.RESET_ALL}")
         print(f"{Fore.GREEN}✓ Size: {output_size:.2f} MB{Style.RESET_ALL}")
         print(f"{Fore.GREEN}✓ Location: {output_path}{Style.RESET_ALL}")
         print(f"{Fore.GREEN}✓ Total processing time: {total_time:.1f} seconds{Style.RESET_ALL}")
         print(f"{Fore.GREEN}✓ Temporary directories and files, including merged_app_decompile_xml and ~/apk_work, have been cleared{Style.RESET_ALL}\n")
+    return bool(out_name)
+
+def main():
+    """Main function"""
+    if len(sys.argv) > 1 and sys.argv[1] == "scan":
+        sys.exit(scan_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(verify_main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Remove PairIP protection from .apks bundles")
+    parser.add_argument("inputs", nargs="*",
+                        help="input .apks file(s) (default: first .apks in the current directory); "
+                             "a trailing directory is taken as the location of libpairipcorex.so")
+    parser.add_argument("--workspace", default="auto",
+                        help="where to put the decompile tree: auto, tmpfs, disk, bench or a directory (default: auto)")
+    parser.add_argument("--minimal-decode", action="store_true",
+                        help="decode only the dex files containing com/pairip classes and reuse the rest unchanged")
+    parser.add_argument("--force", action="store_true",
+                        help="process the input even if it is already patched or has a memoized output")
+    parser.add_argument("--abi", action="append", default=[], choices=SUPPORTED_ABIS,
+                        help="keep only this ABI's native libraries (repeatable)")
+    parser.add_argument("--device-profile",
+                        help="file listing the target device's ABIs (JSON, getprop output or ro.product.cpu.abilist)")
+    parser.add_argument("--split-store", action="store_true",
+                        help="reuse byte-identical split APKs across runs from a content-addressed store")
+    parser.add_argument("--overlay", action="store_true",
+                        help="keep a pristine decompiled tree per input and patch a copy-on-write view of it")
+    parser.add_argument("--no-verify", dest="verify", action="store_false",
+                        help="skip the post-build check of method bodies, manifest, native libraries and signature")
+    parser.add_argument("--no-cds", dest="cds", action="store_false",
+                        help="launch the jars without cached AppCDS archives")
+    parser.add_argument("--order", choices=("given", "longest", "shortest"), default="given",
+                        help="batch order by predicted cost: longest first (makespan), shortest first (latency) "
+                             "or as given (default)")
+    output_mode = parser.add_mutually_exclusive_group()
+    output_mode.add_argument("--headless", action="store_true",
+                             help="structured, rate-limited log lines without spinners (default when stdout is not a terminal)")
+    output_mode.add_argument("--interactive", action="store_true",
+                             help="colored output with spinners and a progress bar even when stdout is not a terminal")
+    args = parser.parse_args()
+    if args.headless or args.interactive:
+        log.set_headless(args.headless)
+
+    if not log.headless:
+        width = shutil.get_terminal_size().columns
+        border = "▓" * width
+
+        line1 = center_text("PairIP Protection Remover v1.3 (Termux Optimized)", width)
+        line2 = center_text("Cross-platform Edition", width)
+        footer = center_text("© void.eth | Modified for Termux by Zalgo", width)
+
+        print(f"\n{Style.BRIGHT}{Fore.CYAN}{border}{Style.RESET_ALL}")
+        print(f"{Style.BRIGHT}{Fore.CYAN}{line1}{Style.RESET_ALL}")
+        print(f"{Style.BRIGHT}{Fore.CYAN}{line2}{Style.RESET_ALL}")
+        print(f"{Style.BRIGHT}{Fore.CYAN}{border}{Style.RESET_ALL}")
+        print(f"{Style.BRIGHT}{Fore.CYAN}{footer}{Style.RESET_ALL}\n")
+
+    inputs = list(args.inputs)
+    so_path = None
+    if inputs and os.path.isdir(inputs[-1]):
+        so_path = os.path.abspath(inputs.pop())
+    if not inputs:
+        apks_files = glob.glob("*.apks")
+        if not apks_files:
+            log.error("No .apks files found in the current directory")
+            sys.exit(1)
+        elif len(apks_files) > 1:
+            log.warning(f"Multiple .apks files found: {', '.join(apks_files)}")
+            log.info(f"Selecting the first one: {apks_files[0]}")
+        inputs = [apks_files[0]]
+    inputs = [os.path.abspath(path) for path in inputs]
+    
+    device_abis = None
+    if args.device_profile:
+        try:
+            device_abis = load_device_abis(args.device_profile)
+        except (OSError, ValueError) as e:
+            log.error(f"Could not read device profile: {e}")
+            sys.exit(1)
+        log.info(f"Device ABIs: {', '.join(device_abis) or 'none recognised'}")
+    
+    log.info("Checking Java installation...")
+    try:
+        java_version = run_command("java -version", verbose=False, check=False)
+        if not java_version:
+            java_version = run_command("java -version 2>&1", verbose=False, check=False)
+        log.success("Java detected")
+    except Exception:
+        log.error("Java not found. Please install Java Runtime Environment")
+        sys.exit(1)
+    
+    model = fit_cost_model()
+    inputs = order_jobs(inputs, model, args.order)
+    predictions = []
+    for path in inputs:
+        try:
+            predictions.append(predict_stage_times(model, os.path.getsize(path)) if model else None)
+        except OSError:
+            predictions.append(None)
+    
+    if len(inputs) == 1:
+        if not run_job(inputs[0], so_path, args, device_abis, predictions[0]):
+            sys.exit(1)
+        return
+    
+    # Batch mode: a failing job is reported and the batch moves on
+    failed = []
+    batch_start = time.time()
+    for i, apks_file in enumerate(inputs):
+        remaining = [sum(p.values()) for p in predictions[i:] if p]
+        eta = f", estimated {sum(remaining):.0f}s remaining" if len(remaining) == len(inputs) - i else ""
+        log.job = os.path.basename(apks_file).rsplit('.', 1)[0]
+        log.header(f"Batch job {i + 1}/{len(inputs)}: {os.path.basename(apks_file)}{eta}")
+        if not run_job(apks_file, so_path, args, device_abis, predictions[i]):
+            failed.append(apks_file)
+    log.job = "batch"
+    log.success(f"Batch finished: {len(inputs) - len(failed)}/{len(inputs)} succeeded in {time.time() - batch_start:.1f} seconds")
+    if failed:
+        log.warning(f"Failed: {', '.join(os.path.basename(path) for path in failed)}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     try:
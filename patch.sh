@@ -140,104 +140,99 @@ delete_dir_file() {
   return 1
 }
 
-# Function to patch VMRunner.smali
-patch_vmrunner() {
-  local file="$1"
-  local new_clinit_block='
-.method static constructor <clinit>()V
-    .registers 1
-
-    .line 30
-    const-string v0, "pairipcorex"
-    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V
+# Smali rewriters. Each is a single awk process that streams the file once and
+# encodes the same method-replacement rules as the Python edition.
+VMRUNNER_AWK='
+function emit_clinit() {
+  print ".method static constructor <clinit>()V"
+  print "    .registers 1"
+  print ""
+  print "    .line 30"
+  print "    const-string v0, \"pairipcorex\""
+  print "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V"
+  print ""
+  print "    const-string v0, \"pairipcore\""
+  print "    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V"
+  print ""
+  print "    return-void"
+  print ".end method"
+}
+inside {
+  if ($0 ~ /^[[:space:]]*\.end method[[:space:]]*$/) inside = 0
+  next
+}
+/^[[:space:]]*\.method/ && index($0, "<clinit>()V") {
+  inside = 1
+  found = 1
+  emit_clinit()
+  next
+}
+{ print }
+END { exit found ? 0 : 1 }
+'
 
-    const-string v0, "pairipcore"
-    invoke-static {v0}, Ljava/lang/System;->loadLibrary(Ljava/lang/String;)V
+SIGCHECK_AWK='
+function stub(lines) {
+  n = split(lines, out, "\n")
+  for (j = 1; j <= n; j++) print out[j]
+  skip = 1
+  found = 1
+}
+skip {
+  if ($0 ~ /^[[:space:]]*\.end method/) skip = 0
+  next
+}
+/^[[:space:]]*\.method/ {
+  if (!integrity && index($0, "verifyIntegrity(Landroid/content/Context;)V")) {
+    integrity = 1
+    print
+    stub("    .registers 1\n    return-void\n.end method")
+    next
+  }
+  if (!signature && index($0, "verifySignatureMatches(Ljava/lang/String;)Z")) {
+    signature = 1
+    stub(".method static verifySignatureMatches(Ljava/lang/String;)Z\n    .registers 1\n\n    const/4 p0, 0x1\n    return p0\n.end method")
+    next
+  }
+  if (!init_license && index($0, "initializeLicenseCheck()V")) {
+    init_license = 1
+    stub(".method public initializeLicenseCheck()V\n    .registers 1\n    return-void\n.end method")
+    next
+  }
+  if (!connect_license && index($0, "connectToLicensingService()V")) {
+    connect_license = 1
+    stub(".method private connectToLicensingService()V\n    .registers 1\n    return-void\n.end method")
+    next
+  }
+}
+{ print }
+END { exit found ? 0 : 1 }
+'
 
-    return-void
-.end method'
+# Run an awk rewriter over a file, replacing it only if a rule matched
+rewrite_with_awk() {
+  local program="$1"
+  local file="$2"
+  local temp_file
+  # Keep the temp file next to the target so the final mv is a rename
+  temp_file=$(mktemp "$file.XXXXXX") || return 1
 
-  # Create a temporary file
-  local temp_file=$(mktemp)
-  
-  # Process the file line by line
-  local inside_clinit=0
-  local method_start_found=0
-  
-  while IFS= read -r line; do
-    if [ $inside_clinit -eq 0 ] && [[ "$line" == *".method"* && "$line" == *"<clinit>()V"* ]]; then
-      inside_clinit=1
-      method_start_found=1
-      echo -e "$new_clinit_block" >> "$temp_file"
-      continue
-    fi
-    
-    if [ $inside_clinit -eq 1 ]; then
-      if [[ "$line" == *".end method"* ]]; then
-        inside_clinit=0
-      fi
-      continue
-    fi
-    
-    echo "$line" >> "$temp_file"
-  done < "$file"
-  
-  # Replace the original file with the modified one
-  mv "$temp_file" "$file"
-  
-  if [ $method_start_found -eq 1 ]; then
+  if awk "$program" "$file" > "$temp_file"; then
+    mv "$temp_file" "$file"
     return 0
-  else
-    return 1
   fi
+  rm -f "$temp_file"
+  return 1
 }
 
-# Function to patch SignatureCheck.smali
+# Function to patch VMRunner.smali
+patch_vmrunner() {
+  rewrite_with_awk "$VMRUNNER_AWK" "$1"
+}
+
+# Function to patch SignatureCheck.smali / LicenseClient.smali
 patch_sigcheck() {
-  local file="$1"
-  
-  # Create a temporary file
-  local temp_file=$(mktemp)
-  
-  # Process the file line by line
-  local inside_verify=0
-  local annotation_ended=0
-  local method_found=0
-  
-  while IFS= read -r line; do
-    if [ $inside_verify -eq 0 ] && [[ "$line" == *".method"* && "$line" == *"verifyIntegrity(Landroid/content/Context;)V"* ]]; then
-      inside_verify=1
-      method_found=1
-    fi
-    
-    if [ $inside_verify -eq 1 ] && [ $annotation_ended -eq 0 ] && [[ "$line" == *".end annotation"* ]]; then
-      annotation_ended=1
-      echo "$line" >> "$temp_file"
-      
-      # Check next few lines for return-void
-      local has_return=0
-      local next_lines=$(head -n 5 <(tail -n +$(grep -n -A 5 -m 1 ".end annotation" "$file" | head -n 1 | cut -d '-' -f 1) "$file"))
-      if [[ "$next_lines" == *"return-void"* ]]; then
-        has_return=1
-      fi
-      
-      if [ $has_return -eq 0 ]; then
-        echo "    return-void" >> "$temp_file"
-      fi
-      continue
-    fi
-    
-    echo "$line" >> "$temp_file"
-  done < "$file"
-  
-  # Replace the original file with the modified one
-  mv "$temp_file" "$file"
-  
-  if [ $method_found -eq 1 ]; then
-    return 0
-  else
-    return 1
-  fi
+  rewrite_with_awk "$SIGCHECK_AWK" "$1"
 }
 
 # Function to patch file_paths.xml
@@ -303,24 +298,24 @@ patch_files() {
   local sigcheck_patched=0
   
   # Find and patch VMRunner.smali
-  find "$base_dir" -name "VMRunner.smali" -path "*/pairip/*" | while read -r file; do
+  while IFS= read -r file; do
     if patch_vmrunner "$file"; then
       log_success "Patched VMRunner.smali"
       vmrunner_patched=1
     fi
-  done
+  done < <(find "$base_dir" -name "VMRunner.smali" -path "*/pairip/*")
   
   if [ $vmrunner_patched -eq 0 ]; then
     log_warning "VMRunner.smali not found or not patched"
   fi
   
-  # Find and patch SignatureCheck.smali
-  find "$base_dir" -name "SignatureCheck.smali" -path "*/pairip/*" | while read -r file; do
+  # Find and patch SignatureCheck.smali / LicenseClient.smali
+  while IFS= read -r file; do
     if patch_sigcheck "$file"; then
-      log_success "Patched SignatureCheck.smali"
+      log_success "Patched $(basename "$file")"
       sigcheck_patched=1
     fi
-  done
+  done < <(find "$base_dir" \( -name "SignatureCheck.smali" -o -name "LicenseClient.smali" \) -path "*/pairip/*")
   
   if [ $sigcheck_patched -eq 0 ]; then
     log_warning "SignatureCheck.smali not found or not patched"
@@ -643,5 +638,7 @@ main() {
 # Handle interruptions
 trap 'echo -e "\n${YELLOW}Process cancelled by user.${NC}"; exit 0' INT
 
-# Run the main function
-main "$@"
\ No newline at end of file
+# Run the main function unless the script is being sourced (e.g. by bench_smali.sh)
+if [[ "${BASH_SOURCE[0]}" == "$0" ]]; then
+  main "$@"
+fi
\ No newline at end of file
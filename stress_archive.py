@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Stress the Python-side archive stages of patch.py with synthetic multi-GB bundles.
+
+Each bundle is a zip64 .apks whose base.apk carries one large stored asset. The
+files are written sparse, so a 5 GB bundle costs almost no disk until a stage
+copies it. Every size runs in a fresh child process, and its peak RSS must stay
+under a fixed ceiling whatever the input size.
+
+Usage: ./stress_archive.py [--sizes 0.5,4.5] [--ceiling-mb 256] [--dir DIR] [--keep]
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CHUNK = 8 * 1024 * 1024
+
+def zero_crc(size):
+    """CRC-32 of size zero bytes"""
+    block = bytes(CHUNK)
+    crc = 0
+    while size:
+        n = min(size, CHUNK)
+        crc = zlib.crc32(block[:n] if n < CHUNK else block, crc)
+        size -= n
+    return crc
+
+def file_crc(path):
+    """CRC-32 of a file, read in chunks"""
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def tiny_dex(descriptor):
+    """A dex whose only type is descriptor: enough for the type-table scanners"""
+    string_data = bytes([len(descriptor)]) + descriptor + b"\0"
+    header = bytearray(0x70)
+    header[:8] = b"dex\n035\0"
+    string_ids_off, type_ids_off = 0x70, 0x74
+    data_off = 0x78
+    struct.pack_into('<4I', header, 0x38, 1, string_ids_off, 1, type_ids_off)
+    struct.pack_into('<I', header, 0x20, data_off + len(string_data))
+    return bytes(header) + struct.pack('<II', data_off, 0) + string_data
+
+def add_stored_sparse(zip_out, name, size, crc, source=None):
+    """Append a stored entry of size bytes, leaving holes instead of writing zeros
+
+    With source, the data is copied from that (sparse) file, preserving its holes.
+    """
+    info = zipfile.ZipInfo(name, (2024, 1, 1, 0, 0, 0))
+    info.compress_type = zipfile.ZIP_STORED
+    info.file_size = info.compress_size = size
+    info.CRC = crc
+    fp = zip_out.fp
+    info.header_offset = fp.tell()
+    fp.write(info.FileHeader(size > zipfile.ZIP64_LIMIT))
+    start = fp.tell()
+    if source:
+        with open(source, 'rb') as src:
+            fd = src.fileno()
+            offset = 0
+            while offset < size:
+                try:
+                    data_start = os.lseek(fd, offset, os.SEEK_DATA)
+                except OSError:
+                    break
+                data_end = os.lseek(fd, data_start, os.SEEK_HOLE)
+                src.seek(data_start)
+                fp.seek(start + data_start)
+                remaining = data_end - data_start
+                while remaining:
+                    chunk = src.read(min(CHUNK, remaining))
+                    fp.write(chunk)
+                    remaining -= len(chunk)
+                offset = data_end
+    fp.seek(start + size)
+    fp.truncate()
+    zip_out.filelist.append(info)
+    zip_out.NameToInfo[name] = info
+    zip_out.start_dir = fp.tell()
+    zip_out._didModify = True
+
+def build_bundle(directory, asset_size):
+    """Write base.apk with a large sparse asset and wrap it with an x86_64 split into a bundle"""
+    base_apk = os.path.join(directory, "base.apk")
+    with zipfile.ZipFile(base_apk, 'w') as z:
+        z.writestr("AndroidManifest.xml", b"<manifest/>\0" + "com.pairip.licensecheck.LicenseActivity".encode('utf-16-le'))
+        z.writestr("classes.dex", tiny_dex(b"Lcom/pairip/VMRunner;"))
+        z.writestr("classes2.dex", tiny_dex(b"Lcom/example/Main;"))
+        z.writestr("lib/arm64-v8a/libpairipcore.so", b"\x7fELF" + bytes(1024))
+        z.writestr("lib/x86_64/libpairipcore.so", b"\x7fELF" + bytes(1024))
+        add_stored_sparse(z, "assets/big.bin", asset_size, zero_crc(asset_size))
+    split_apk = os.path.join(directory, "split_config.x86_64.apk")
+    with zipfile.ZipFile(split_apk, 'w') as z:
+        z.writestr("lib/x86_64/libfoo.so", bytes(4096))
+    bundle = os.path.join(directory, "bundle.apks")
+    with zipfile.ZipFile(bundle, 'w') as z:
+        add_stored_sparse(z, "base.apk", os.path.getsize(base_apk), file_crc(base_apk), source=base_apk)
+        z.write(split_apk, "split_config.x86_64.apk")
+    os.remove(base_apk)
+    os.remove(split_apk)
+    return bundle
+
+def run_stages(bundle, work_dir, results_path):
+    """Child side: run each archive stage once and record time and peak RSS after it"""
+    os.environ["XDG_CACHE_HOME"] = os.path.join(work_dir, "cache")
+    sys.path.insert(0, SCRIPT_DIR)
+    import patch
+    patch.log.set_headless(True)
+    results = []
+
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        value = func(*args)
+        results.append({"stage": name, "seconds": round(time.perf_counter() - start, 2),
+                        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss})
+        return value
+
+    merged = os.path.join(work_dir, "merged_app.apk")
+    slim = os.path.join(work_dir, "slim_app.apk")
+    out = os.path.join(work_dir, "out.apk")
+    stage("check_zip_structure", patch.check_zip_structure, bundle)
+    stage("scan_input", patch.scan_input, bundle)
+    stage("split_store", patch.stage_splits_from_store, bundle, os.path.join(work_dir, "splits"))
+    stage("extract_base", patch.extract_file, bundle, "base.apk", work_dir)
+    os.replace(os.path.join(work_dir, "base.apk"), merged)
+    shutil.rmtree(os.path.join(work_dir, "splits"))
+    shutil.rmtree(os.path.join(work_dir, "cache"))
+    stage("firebase_lib", patch.link_or_copy, merged, os.path.join(work_dir, "libFirebaseCppApp.so"))
+    stage("filter_abis", patch.filter_apk_abis, merged, ["arm64-v8a"])
+    stage("pairip_lib_abis", patch.pairip_lib_abis, merged)
+    keep_dex = stage("find_pairip_dex", patch.find_pairip_dex, merged)
+    stage("create_slim_apk", patch.create_slim_apk, merged, slim, keep_dex)
+    stage("splice_minimal_build", patch.splice_minimal_build, merged, slim, out)
+    os.remove(merged)
+    stage("verify_output_apk", patch.verify_output_apk, out)
+    stage("file_sha256", patch.file_sha256, out)
+    with open(results_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that patch.py's archive stages run in bounded memory")
+    parser.add_argument("--sizes", default="0.5,4.5", help="comma separated asset sizes in GB (default: 0.5,4.5)")
+    parser.add_argument("--ceiling-mb", type=int, default=256, help="peak RSS limit per run (default: 256)")
+    parser.add_argument("--dir", default=None, help="scratch directory (default: system temp dir)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files")
+    parser.add_argument("--child", nargs=3, metavar=("BUNDLE", "WORK_DIR", "RESULTS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_stages(*args.child)
+        return 0
+
+    failed = False
+    for size_gb in (float(size) for size in args.sizes.split(",")):
+        scratch = tempfile.mkdtemp(prefix="pairip-stress-", dir=args.dir)
+        try:
+            start = time.perf_counter()
+            bundle = build_bundle(scratch, int(size_gb * 1024 ** 3))
+            print(f"== {size_gb:g} GB bundle ({os.path.getsize(bundle) / 1024 ** 3:.2f} GB, "
+                  f"zip64: {os.path.getsize(bundle) > zipfile.ZIP64_LIMIT}) built in {time.perf_counter() - start:.1f}s")
+            work_dir = os.path.join(scratch, "work")
+            os.makedirs(work_dir)
+            results_path = os.path.join(scratch, "results.json")
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", bundle, work_dir, results_path],
+                                   stdout=subprocess.DEVNULL)
+            if child.returncode != 0:
+                print(f"   stages failed (exit {child.returncode})")
+                failed = True
+                continue
+            with open(results_path, encoding='utf-8') as f:
+                results = json.load(f)
+            for result in results:
+                print(f"   {result['stage']:<22} {result['seconds']:>7.2f}s   peak RSS {result['peak_rss_kb'] / 1024:7.1f} MB")
+            peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+            verdict = "ok" if peak_mb <= args.ceiling_mb else "OVER CEILING"
+            print(f"   peak RSS across runs so far: {peak_mb:.1f} MB (ceiling {args.ceiling_mb} MB): {verdict}")
+            failed = failed or peak_mb > args.ceiling_mb
+        finally:
+            if not args.keep:
+                shutil.rmtree(scratch, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())